@@ -0,0 +1,98 @@
+import sqlite3
+from langchain_core.messages import BaseMessage
+from langgraph.checkpoint.sqlite import SqliteSaver
+from langgraph.serde.jsonplus import JsonPlusSerializer
+
+
+class StateSerializer(JsonPlusSerializer):
+    """JSON checkpoint serializer that keeps the `role` every node tags its message with.
+
+    Messages are written with to_json(), which only lists the declared fields,
+    so the role is added to the constructor kwargs; loading passes it back to
+    the message class. Nothing is unpickled, so a checkpoint file cannot run
+    code when it is read.
+    """
+
+    def _default(self, obj):
+        encoded = super()._default(obj)
+        role = getattr(obj, "role", None)
+        if isinstance(obj, BaseMessage) and role is not None:
+            encoded["kwargs"] = {**encoded["kwargs"], "role": role}
+        return encoded
+
+    def loads(self, data):
+        # Old checkpoints written with pickle are refused rather than loaded
+        if data[:1] == b"\x80":
+            raise ValueError("Pickled checkpoints are not loaded; delete the checkpoint database and rerun")
+        return super().loads(data)
+
+
+def get_sqlite_checkpointer(db_path="checkpoints.sqlite"):
+    """SQLite checkpointer for workflows driven with invoke/stream."""
+    conn = sqlite3.connect(db_path, check_same_thread=False)
+    return SqliteSaver(conn, serde=StateSerializer())
+
+
+def get_async_sqlite_checkpointer(db_path="checkpoints.sqlite"):
+    """SQLite checkpointer for workflows driven with ainvoke/astream (needs aiosqlite)."""
+    import aiosqlite
+    from langgraph.checkpoint.aiosqlite import AsyncSqliteSaver
+
+    return AsyncSqliteSaver(aiosqlite.connect(db_path), serde=StateSerializer())
+
+
+def get_run_config(run_id, recursion_limit=40):
+    # The run id is the checkpoint thread, so every retry of the same run reads
+    # and extends the same chain of checkpoints
+    return {"recursion_limit": recursion_limit, "configurable": {"thread_id": str(run_id)}}
+
+
+def retry_config(history, config):
+    """Config of the last checkpoint before a node failed, or None.
+
+    Resuming from it re-runs the failed node and everything after it, while
+    the nodes that had already succeeded are kept.
+    """
+    for snapshot in history:
+        # History is newest first
+        if snapshot.next and not snapshot.values.get("failures"):
+            return {**config, "configurable": snapshot.config["configurable"]}
+    return None
+
+
+def run_workflow(workflow, inputs, config):
+    """Run the workflow, resuming at the first incomplete node of an earlier attempt."""
+    if workflow.checkpointer is None:
+        return workflow.invoke(inputs, config)
+
+    snapshot = workflow.get_state(config)
+    if snapshot.next:
+        # Passing no input continues from the last saved checkpoint
+        return workflow.invoke(None, config)
+    if snapshot.metadata is not None:
+        if snapshot.values.get("failures"):
+            # The earlier attempt stopped at a failed node; retry from just before it
+            resume_config = retry_config(workflow.get_state_history(config), config)
+            if resume_config is not None:
+                return workflow.invoke(None, resume_config)
+        # This run already finished, nothing to redo
+        return snapshot.values
+    return workflow.invoke(inputs, config)
+
+
+async def arun_workflow(workflow, inputs, config):
+    """Async counterpart of run_workflow."""
+    if workflow.checkpointer is None:
+        return await workflow.ainvoke(inputs, config)
+
+    snapshot = await workflow.aget_state(config)
+    if snapshot.next:
+        return await workflow.ainvoke(None, config)
+    if snapshot.metadata is not None:
+        if snapshot.values.get("failures"):
+            history = [past async for past in workflow.aget_state_history(config)]
+            resume_config = retry_config(history, config)
+            if resume_config is not None:
+                return await workflow.ainvoke(None, resume_config)
+        return snapshot.values
+    return await workflow.ainvoke(inputs, config)
@@ -1,87 +1,293 @@
-from langgraph.graph import StateGraph, END
-from langchain_core.messages import HumanMessage
+from langgraph.graph import StateGraph, START
+from langchain_core.runnables import RunnableLambda
 from agents.agents import (
     FlexibleAgent
 )
-from tools.preprocessing_tool import preprocessing_tool
-from tools.analysis_node1_tool import analysis_node1_tool
+from tools.preprocessing_tool import preprocessing_tool, PREPROCESSING_TOOL_VERSION
+from tools.analysis_node1_tool import analysis_node1_tool, ANALYSIS_NODE1_TOOL_VERSION
+from tools.linguistics import LINGUISTICS_ROLE
 from tools.knowledge_base_loader import knowledge_base_loader
 from tools.format_report import format_report
-from states.state import AgentGraphState
+from tools.memoize import memoize_tool
+from states.state import AgentGraphState, no_update
+from utils.cancellation import get_cancel_token
 from prompts.prompts import (
     analysis_node2_prompt,
     feedback_generation_prompt,
     scoring_prompt,
-    paraphrasing_prompt
+    paraphrasing_prompt,
+    analysis_node2_guided_json,
+    feedback_generation_guided_json,
+    scoring_guided_json,
+    paraphrasing_guided_json,
+    analysis_node2_prefix_prompt,
+    analysis_node2_input_prompt,
+    feedback_generation_prefix_prompt,
+    feedback_generation_input_prompt,
+    scoring_prefix_prompt,
+    scoring_input_prompt,
+    paraphrasing_prefix_prompt,
+    paraphrasing_input_prompt,
+    grading_prompt,
+    grading_prefix_prompt,
+    grading_input_prompt,
+    grading_guided_json
 )
 
 plan = {
     "nodes": [
-        {"name": "knowledgeBase", "type": "tool", "function": knowledge_base_loader},
-        {"name": "preprocessing", "type": "tool", "function": preprocessing_tool},
-        {"name": "analysis_node1", "type": "tool", "function": analysis_node1_tool},
+        {"name": "knowledgeBase", "type": "tool", "function": knowledge_base_loader,
+         "variables": []},
+        {"name": "preprocessing", "type": "tool", "function": preprocessing_tool,
+         "variables": [], "version": PREPROCESSING_TOOL_VERSION},
+        {"name": "analysis_node1", "type": "tool", "function": analysis_node1_tool,
+         "variables": ["preprocessing"], "version": ANALYSIS_NODE1_TOOL_VERSION,
+         # Message roles the tool reads besides its variables, hashed into its cache key
+         "reads": [LINGUISTICS_ROLE]},
         {"name": "analysis_node2", "type": "agent", "class": FlexibleAgent, 
-         "prompt": analysis_node2_prompt, 
+         "prompt": analysis_node2_prompt,
+         "prefix_prompt": analysis_node2_prefix_prompt,
+         "input_prompt": analysis_node2_input_prompt, 
          "variables": ["preprocessing", "analysis_node1", "knowledgeBase"],
-         "user_content": "Please provide your analysis."},
+         "user_content": "Please provide your analysis.",
+         "kb_query": "task achievement position ideas examples coherence cohesion organisation progression cohesive devices",
+         "kb_top_k": 4,
+         "guided_json": analysis_node2_guided_json},
         {"name": "feedback_generation", "type": "agent", "class": FlexibleAgent,
          "prompt": feedback_generation_prompt,
+         "prefix_prompt": feedback_generation_prefix_prompt,
+         "input_prompt": feedback_generation_input_prompt,
          "variables": ["preprocessing", "analysis_node1", "analysis_node2", "knowledgeBase"],
-         "user_content": "Please provide your detailed feedback."},
+         "user_content": "Please provide your detailed feedback.",
+         "kb_query": "feedback grammar vocabulary task achievement coherence cohesion writing style improvements",
+         "kb_top_k": 4,
+         "guided_json": feedback_generation_guided_json},
         {"name": "scoring", "type": "agent", "class": FlexibleAgent,
          "prompt": scoring_prompt,
+         "prefix_prompt": scoring_prefix_prompt,
+         "input_prompt": scoring_input_prompt,
          "variables": ["analysis_node1", "analysis_node2", "knowledgeBase"],
-         "user_content": "Please provide the IELTS writing score breakdown."},
+         "user_content": "Please provide the IELTS writing score breakdown.",
+         "kb_query": "band descriptors score task achievement coherence cohesion lexical resource grammatical range accuracy",
+         "kb_top_k": 6,
+         "guided_json": scoring_guided_json},
         {"name": "paraphrasing", "type": "agent", "class": FlexibleAgent,
          "prompt": paraphrasing_prompt,
+         "prefix_prompt": paraphrasing_prefix_prompt,
+         "input_prompt": paraphrasing_input_prompt,
          "variables": ["preprocessing", "scoring", "knowledgeBase"],
-         "user_content": "Please provide the improved, Band 8 level paraphrased version."},
-        {"name": "report_generation", "type": "tool", "function": format_report}
+         "user_content": "Please provide the improved, Band 8 level paraphrased version.",
+         "kb_query": "band 8 paraphrasing vocabulary collocations linking words complex sentences",
+         "kb_top_k": 4,
+         "guided_json": paraphrasing_guided_json,
+         # Rewrites the whole essay, so it generates the longest output. A node
+         # timeout is a minimum over the provider's and does not reach ChatOpenAI
+         "timeout": {"read": 180}},
+        {"name": "report_generation", "type": "tool", "function": format_report,
+         "variables": ["analysis_node1", "analysis_node2", "feedback_generation", "scoring", "paraphrasing"]}
     ],
-    "edges": [
-        ("knowledgeBase", "preprocessing"),
-        ("preprocessing", "analysis_node1"),
-        ("analysis_node1", "analysis_node2"),
-        ("analysis_node2", "feedback_generation"),
-        ("feedback_generation", "scoring"),
-        ("scoring", "paraphrasing"),
-        ("paraphrasing", "report_generation")
-    ],
-    "entry_point": "knowledgeBase",
     "finish_point": "report_generation"
 }
 
-def create_graph(server=None, model=None, stop=None, model_endpoint=None, temperature=0):
+# Nodes replaced by the single "grading" call in the fused plan
+FUSED_GRADING_NODES = ["analysis_node2", "feedback_generation", "scoring"]
+
+fused_grading_node = {
+    "name": "grading", "type": "agent", "class": FlexibleAgent,
+    "prompt": grading_prompt,
+    "prefix_prompt": grading_prefix_prompt,
+    "input_prompt": grading_input_prompt,
+    "variables": ["preprocessing", "analysis_node1", "knowledgeBase"],
+    "user_content": "Please provide your analysis, detailed feedback and the IELTS writing score breakdown.",
+    "kb_query": "task achievement coherence cohesion feedback grammar vocabulary band descriptors score lexical resource grammatical range accuracy",
+    "kb_top_k": 6,
+    "guided_json": grading_guided_json,
+    # Generates three nodes' worth of output in one call (a minimum, as above)
+    "timeout": {"read": 240},
+    # Messages emitted by this node, one per replaced node, so the downstream
+    # nodes and format_report read the same roles as in the default plan
+    "outputs": FUSED_GRADING_NODES
+}
+
+# Same pipeline with analysis_node2, feedback_generation and scoring answered by
+# one structured call, which sends the shared context once instead of three times
+fused_plan = {
+    "nodes": [
+        fused_grading_node if node["name"] == "analysis_node2" else node
+        for node in plan["nodes"]
+        if node["name"] not in ("feedback_generation", "scoring")
+    ],
+    "finish_point": plan["finish_point"]
+}
+
+PLANS = {"separate": plan, "fused": fused_plan}
+
+def build_edges(nodes):
+    """Derive the graph edges from the "variables" each node declares.
+
+    A node only waits on the dependencies that are not already implied by
+    another of its dependencies, so independent nodes share a superstep and
+    run concurrently. A variable names the node that produces it, or a role
+    listed in a node's "outputs".
+    """
+    producers = {}
+    for node in nodes:
+        for role in node.get("outputs", [node["name"]]):
+            producers[role] = node["name"]
+
+    for node in nodes:
+        unknown = [var for var in node.get("variables", []) if var not in producers]
+        if unknown:
+            raise ValueError(f"Node '{node['name']}' depends on unknown nodes: {sorted(unknown)}")
+
+    # Variables mapped to their producing nodes, in declaration order without duplicates
+    node_variables = {
+        node["name"]: list(dict.fromkeys(producers[var] for var in node.get("variables", [])))
+        for node in nodes
+    }
+    dependencies = {name: set(variables) for name, variables in node_variables.items()}
+
+    ancestors = {}
+
+    def collect_ancestors(name, visiting=()):
+        if name in visiting:
+            raise ValueError(f"Dependency cycle detected at node '{name}'")
+        if name not in ancestors:
+            found = set()
+            for dep in dependencies[name]:
+                found |= {dep} | collect_ancestors(dep, visiting + (name,))
+            ancestors[name] = found
+        return ancestors[name]
+
+    edges = []
+    for node in nodes:
+        name = node["name"]
+        deps = dependencies[name]
+        implied = set().union(*(collect_ancestors(dep) for dep in deps)) if deps else set()
+        direct = [var for var in node_variables[name] if var not in implied]
+        if not direct:
+            edges.append((START, name))
+        elif len(direct) == 1:
+            edges.append((direct[0], name))
+        else:
+            # Fan-in: wait until every parallel branch has finished
+            edges.append((direct, name))
+    return edges
+
+def agent_arguments(node, prompt_layout="inline", token_budget=None):
+    """Per-call arguments of FlexibleAgent.invoke/ainvoke taken from a plan node.
+
+    With prompt_layout="prefix" the static instructions and knowledge base form
+    the system message and the essay-specific content moves to the user message.
+    """
+    prefix_layout = prompt_layout == "prefix"
+    return {
+        "prompt_template": node["prefix_prompt"] if prefix_layout else node["prompt"],
+        "input_template": node["input_prompt"] if prefix_layout else None,
+        "required_variables": node["variables"],
+        "user_content": node["user_content"],
+        # Number of knowledge base passages retrieved for the node; None sends the whole file
+        "kb_query": node.get("kb_query"),
+        "kb_top_k": node.get("kb_top_k"),
+        # Token ceiling for the formatted prompt; a node's own value wins over the graph default
+        "token_budget": node.get("token_budget", token_budget),
+    }
+
+def route_after(targets, finish_point):
+    """Conditional edge that skips to the report as soon as a node has failed."""
+    def route(state):
+        if state.get("failures"):
+            return finish_point
+        return targets
+    return route
+
+def create_graph(server=None, model=None, stop=None, model_endpoint=None, temperature=0, response_cache=None, tool_cache=None, prompt_layout="inline", token_budget=None, grading_mode="separate", hedge=None):
+    if prompt_layout not in ("inline", "prefix"):
+        raise ValueError(f"Unknown prompt layout: {prompt_layout}")
+    if grading_mode not in PLANS:
+        raise ValueError(f"Unknown grading mode: {grading_mode}")
+    selected_plan = PLANS[grading_mode]
+
     graph = StateGraph(AgentGraphState)
 
+    def make_agent(state, node):
+        return FlexibleAgent(
+            state=state,
+            role_name=node["name"],  # Pass the role name here
+            model=model,
+            server=server,
+            stop=stop,
+            model_endpoint=model_endpoint,
+            temperature=temperature,
+            guided_json=node.get("guided_json"),
+            response_cache=response_cache,
+            # Ask providers with explicit prompt caching to cache the static prefix
+            prompt_caching=prompt_layout == "prefix",
+            output_roles=node.get("outputs"),
+            timeout=node.get("timeout"),
+            # Optional second backend raced against slow calls (models.resilience.HedgedModel)
+            hedge=hedge
+        )
+
     # Dynamically add nodes based on the plan
-    for node in plan["nodes"]:
+    for node in selected_plan["nodes"]:
         if node["type"] == "tool":
-            graph.add_node(node["name"], node["function"])
+            if "version" in node:
+                # Versioned tools are pure functions of their inputs, so memoize them
+                graph.add_node(node["name"], memoize_tool(
+                    node["function"], node["name"], node["version"], node["variables"] + node.get("reads", []), tool_cache
+                ))
+            else:
+                graph.add_node(node["name"], node["function"])
         elif node["type"] == "agent":
-            graph.add_node(
-                node["name"],
-                lambda state, node=node: FlexibleAgent(
-                    state=state,
-                    role_name=node["name"],  # Pass the role name here
-                    model=model,
-                    server=server,
-                    stop=stop,
-                    model_endpoint=model_endpoint,
-                    temperature=temperature
-                ).invoke(state, node["prompt"], node["variables"], node["user_content"])
-            )
-
-    # Dynamically add edges based on the plan
-    for edge in plan["edges"]:
-        graph.add_edge(edge[0], edge[1])
-
-    # Set entry and finish points
-    graph.set_entry_point(plan["entry_point"])
-    graph.set_finish_point(plan["finish_point"])
+            # Agent nodes expose both paths so the workflow can be driven with
+            # stream/invoke or natively with astream/ainvoke. A branch running in
+            # parallel with a failed node is not routed away, so it checks too.
+            # A cancelled run (see utils.cancellation) stops before the next call.
+            def run_agent(state, config, node=node):
+                cancel_token = get_cancel_token(config)
+                if cancel_token:
+                    cancel_token.check()
+                if state.get("failures"):
+                    print(f"Skipping {node['name']} after a failed node")
+                    return no_update()
+                return make_agent(state, node).invoke(state, **agent_arguments(node, prompt_layout, token_budget))
+
+            async def run_agent_async(state, config, node=node):
+                cancel_token = get_cancel_token(config)
+                if cancel_token:
+                    cancel_token.check()
+                if state.get("failures"):
+                    print(f"Skipping {node['name']} after a failed node")
+                    return no_update()
+                return await make_agent(state, node).ainvoke(state, **agent_arguments(node, prompt_layout, token_budget))
+
+            graph.add_node(node["name"], RunnableLambda(run_agent, afunc=run_agent_async, name=node["name"]))
+
+    # Dynamically add edges from the dependencies declared in the plan. Plain
+    # edges leaving a node become conditional, so a failure goes straight to the
+    # report instead of through the remaining LLM nodes.
+    finish_point = selected_plan["finish_point"]
+    successors = {}
+    for start_key, end_key in build_edges(selected_plan["nodes"]):
+        if isinstance(start_key, list) or start_key == START:
+            graph.add_edge(start_key, end_key)
+        else:
+            successors.setdefault(start_key, []).append(end_key)
+    for start_key, targets in successors.items():
+        graph.add_conditional_edges(
+            start_key,
+            route_after(targets, finish_point),
+            list(dict.fromkeys(targets + [finish_point]))
+        )
+
+    # Set finish point
+    graph.set_finish_point(finish_point)
 
     return graph
 
-def compile_workflow(graph):
-    workflow = graph.compile()
+def compile_workflow(graph, checkpointer=None):
+    # With a checkpointer the state is saved after every superstep, keyed by the
+    # run id passed as thread_id (see agent_graph.checkpointer)
+    workflow = graph.compile(checkpointer=checkpointer)
     return workflow
\ No newline at end of file
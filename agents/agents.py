@@ -2,12 +2,13 @@
 # import yaml
 # import os
 from termcolor import colored
-from models.openai_models import get_open_ai, get_open_ai_json
-from models.ollama_models import OllamaModel, OllamaJSONModel
-from models.vllm_models import VllmJSONModel, VllmModel
-from models.groq_models import GroqModel, GroqJSONModel
-from models.claude_models import ClaudVertexModel, ClaudVertexJSONModel
-from models.gemini_models import GeminiModel, GeminiJSONModel
+from models.registry import get_client
+from models.response_cache import CachedModel
+from models.structured_output import ValidatedModel
+from models.http_client import call_timeout
+from models.resilience import HedgedModel
+from models.usage import get_token_usage
+from agents.token_budget import fit_to_budget
 from langchain_core.messages import HumanMessage
 import json
 from datetime import datetime
@@ -18,7 +19,8 @@ from prompts.prompts import (
     paraphrasing_prompt
 )
 from utils.helper_functions import get_current_utc_datetime, check_for_content
-from states.state import AgentGraphState
+from tools.knowledge_base_retriever import retrieve_knowledge_base
+from states.state import AgentGraphState, node_failure
 from pymongo import MongoClient
 
 # # MongoDB connection setup
@@ -26,8 +28,13 @@ from pymongo import MongoClient
 # db = client['FeedParser']  # This is your database name
 
 class Agent:
-    def __init__(self, state: AgentGraphState, model=None, server=None, temperature=0, model_endpoint=None, stop=None, guided_json=None):
+    def __init__(self, state: AgentGraphState, model=None, server=None, temperature=0, model_endpoint=None, stop=None, guided_json=None, response_cache=None, prompt_caching=False, hedge=None):
         self.state = state
+        # Second backend for hedged requests: {"server", "model", "model_endpoint"},
+        # each defaulting to the primary's
+        self.hedge = hedge
+        self.response_cache = response_cache
+        self.prompt_caching = prompt_caching
         self.model = model
         self.server = server
         self.temperature = temperature
@@ -36,58 +43,69 @@ class Agent:
         self.guided_json = guided_json
 
     def get_llm(self, json_model=True):
-        if self.server == 'openai':
-            return get_open_ai_json(model=self.model, temperature=self.temperature) if json_model else get_open_ai(model=self.model, temperature=self.temperature)
-        if self.server == 'ollama':
-            return OllamaJSONModel(model=self.model, temperature=self.temperature) if json_model else OllamaModel(model=self.model, temperature=self.temperature)
-        if self.server == 'vllm':
-            return VllmJSONModel(
-                model=self.model, 
-                guided_json=self.guided_json,
-                stop=self.stop,
-                model_endpoint=self.model_endpoint,
-                temperature=self.temperature
-            ) if json_model else VllmModel(
-                model=self.model,
-                model_endpoint=self.model_endpoint,
+        # Clients are pooled per configuration instead of being rebuilt on
+        # every node invocation
+        llm = get_client(
+            server=self.server,
+            model=self.model,
+            temperature=self.temperature,
+            model_endpoint=self.model_endpoint,
+            json_model=json_model,
+            stop=self.stop,
+            guided_json=self.guided_json,
+            prompt_caching=self.prompt_caching
+        )
+        if self.hedge:
+            hedge_llm = get_client(
+                server=self.hedge.get("server", self.server),
+                model=self.hedge.get("model", self.model),
+                temperature=self.temperature,
+                model_endpoint=self.hedge.get("model_endpoint", self.model_endpoint),
+                json_model=json_model,
                 stop=self.stop,
-                temperature=self.temperature
-            )
-        if self.server == 'groq':
-            return GroqJSONModel(
-                model=self.model,
-                temperature=self.temperature
-            ) if json_model else GroqModel(
-                model=self.model,
-                temperature=self.temperature
+                guided_json=self.guided_json,
+                prompt_caching=self.prompt_caching
             )
-        if self.server == 'claude':
-            return ClaudVertexJSONModel(
-                model=self.model,
-                temperature=self.temperature
-            ) if json_model else ClaudVertexModel(
-                model=self.model,
-                temperature=self.temperature
+            # Latencies are tracked per node, as their prompts and outputs differ in size
+            latency_key = f"{self.server}:{self.model}:{getattr(self, 'role_name', '')}"
+            llm = HedgedModel(llm, hedge_llm, latency_key, hedge_after=self.hedge.get("hedge_after", 30.0))
+        if json_model and self.guided_json:
+            # Checked before caching, so only responses matching the schema are reused
+            llm = ValidatedModel(llm, self.guided_json)
+        if self.response_cache is not None:
+            llm = CachedModel(
+                llm, self.response_cache, self.server, self.model, self.temperature, json_model,
+                guided_json=self.guided_json if json_model else None,
+                model_endpoint=self.model_endpoint
             )
-        if self.server == 'gemini':
-            return GeminiJSONModel(
-                model=self.model,
-                temperature=self.temperature
-            ) if json_model else GeminiModel(
-                model=self.model,
-                temperature=self.temperature
-            )      
+        return llm
 
     def update_state(self, key, value):
         self.state = {**self.state, key: value}
 
 
 class FlexibleAgent(Agent):
-    def __init__(self, state: AgentGraphState, role_name: str, model=None, server=None, temperature=0, model_endpoint=None, stop=None, guided_json=None):
-        super().__init__(state, model, server, temperature, model_endpoint, stop, guided_json)
+    def __init__(self, state: AgentGraphState, role_name: str, model=None, server=None, temperature=0, model_endpoint=None, stop=None, guided_json=None, response_cache=None, prompt_caching=False, output_roles=None, timeout=None, hedge=None):
+        super().__init__(state, model, server, temperature, model_endpoint, stop, guided_json, response_cache, prompt_caching, hedge)
         self.role_name = role_name
-
-    def invoke(self, state, prompt_template, required_variables, user_content):
+        # Minimum connect/read timeouts of this node's model calls; the provider's
+        # apply when they are longer (see models.http_client.call_timeout)
+        self.timeout = timeout
+        # A fused agent answers for several nodes at once; its JSON response is
+        # keyed by these roles and split into one message per role
+        self.output_roles = output_roles
+        self.prompt_report = None
+
+    def build_messages(self, state, prompt_template, required_variables, user_content, kb_query=None, kb_top_k=None, input_template=None, token_budget=None):
+        """Format the node's prompt into system and user messages.
+
+        Without input_template the whole prompt_template becomes the system
+        message. With it, prompt_template only holds the static instructions
+        and knowledge base, and input_template carries the essay-specific
+        content in the user message, so every essay shares the same cacheable
+        prefix. With a token_budget the variables are shrunk until the prompt
+        fits, and the reductions are kept in self.prompt_report.
+        """
         # Extract required variables from state
         variables = {}
         for var in required_variables:
@@ -104,7 +122,13 @@ class FlexibleAgent(Agent):
             if var == 'preprocessing' and 'text' in content:
                 prompt_variables['text'] = content['text']
             elif var == 'knowledgeBase' and 'knowledge_base' in content:
-                prompt_variables['knowledge_base'] = content['knowledge_base']
+                if kb_top_k:
+                    # Only send the passages relevant to this node's task (and, unless
+                    # the prefix has to stay identical across essays, to the essay)
+                    query = (kb_query or '') if input_template else f"{kb_query or ''}\n{state['user_input']}"
+                    prompt_variables['knowledge_base'] = retrieve_knowledge_base(content['knowledge_base'], query, kb_top_k)
+                else:
+                    prompt_variables['knowledge_base'] = content['knowledge_base']
             elif var in ['analysis_node1', 'analysis_node2']:
                 if 'analysis_results' not in prompt_variables:
                     prompt_variables['analysis_results'] = {}
@@ -117,27 +141,86 @@ class FlexibleAgent(Agent):
             prompt_variables['analysis_results'] = json.dumps(prompt_variables['analysis_results'], indent=2)
 
         # Format the prompt
-        try:
-            system_content = prompt_template.format(**prompt_variables)
-        except KeyError as e:
-            raise KeyError(f"Missing key in prompt template: {e}. Available keys: {prompt_variables.keys()}")
-
-        messages = [
+        def render(prompt_variables):
+            try:
+                system_content = prompt_template.format(**prompt_variables)
+                if input_template:
+                    return [system_content, f"{input_template.format(**prompt_variables)}\n{user_content}"]
+                return [system_content, user_content]
+            except KeyError as e:
+                raise KeyError(f"Missing key in prompt template: {e}. Available keys: {prompt_variables.keys()}")
+
+        if token_budget:
+            prompt_variables, self.prompt_report = fit_to_budget(render, prompt_variables, token_budget)
+            if self.prompt_report["tokens_after"] < self.prompt_report["tokens_before"]:
+                print(f"{self.role_name} prompt reduced from {self.prompt_report['tokens_before']} to {self.prompt_report['tokens_after']} tokens (budget {token_budget})")
+
+        system_content, user_content = render(prompt_variables)
+        return [
             {"role": "system", "content": system_content},
             {"role": "user", "content": user_content}
         ]
 
-        llm = self.get_llm()
-        ai_msg = llm.invoke(messages)
-
+    def response_failure(self, content):
+        """The node failure an error response stands for, or None for a usable response."""
+        try:
+            result = json.loads(content)
+        except (TypeError, ValueError):
+            # Every agent node's output is read back as JSON by the nodes after it
+            return node_failure(self.role_name, "invalid_output", "Response is not valid JSON")
+        if not isinstance(result, dict) or "error" not in result:
+            return None
+
+        if "schema_errors" in result:
+            failure_type = "schema_error"
+        elif "raw_response" in result:
+            failure_type = "invalid_output"
+        else:
+            failure_type = "provider_error"
+        return node_failure(self.role_name, failure_type, result["error"])
+
+    def handle_response(self, ai_msg):
         # Log the response
         with open("D:/VentureInternship/AI Agent/ProjectK/response.txt", 'a') as file:
             file.write(f'\n{self.role_name} response:{ai_msg.content}\n')
 
-        # Update the state with the agent's response using the correct role name
-        state["messages"].append(
-            HumanMessage(role=self.role_name, content=ai_msg.content)
-        )
+        # An error is recorded as a typed failure instead of becoming this node's
+        # output, so no later node spends a call on it
+        failure = self.response_failure(ai_msg.content)
+        if failure:
+            print(f"{self.role_name} failed: {failure['failures'][0]['message']}")
+            return failure
+
+        # Report provider-side prompt caching so the savings can be verified
+        usage = get_token_usage(ai_msg)
+        if usage:
+            print(f"{self.role_name} tokens: prompt={usage['prompt_tokens']} cached={usage['cached_tokens']} completion={usage['completion_tokens']}")
+
+        # Return only this agent's response; the add_messages reducer merges it
+        # into the state, which keeps updates from parallel branches safe
+        response_metadata = {"token_usage": usage, "prompt_budget": self.prompt_report}
+        if not self.output_roles:
+            return {"messages": [HumanMessage(role=self.role_name, content=ai_msg.content, response_metadata=response_metadata)]}
+
+        result = json.loads(ai_msg.content)
+        missing = [role for role in self.output_roles if not isinstance(result, dict) or role not in result]
+        if missing:
+            return node_failure(self.role_name, "invalid_output", f"Response has no section for {missing}")
+        messages = [HumanMessage(role=role, content=json.dumps(result[role])) for role in self.output_roles]
+        # The usage of the single call is recorded once, on the first message
+        messages[0].response_metadata = response_metadata
+        return {"messages": messages}
+
+    def invoke(self, state, prompt_template, required_variables, user_content, **prompt_options):
+        messages = self.build_messages(state, prompt_template, required_variables, user_content, **prompt_options)
+        llm = self.get_llm()
+        with call_timeout(self.timeout):
+            ai_msg = llm.invoke(messages)
+        return self.handle_response(ai_msg)
 
-        # Return the updated state
-        return {"messages": state["messages"]}
\ No newline at end of file
+    async def ainvoke(self, state, prompt_template, required_variables, user_content, **prompt_options):
+        messages = self.build_messages(state, prompt_template, required_variables, user_content, **prompt_options)
+        llm = self.get_llm()
+        with call_timeout(self.timeout):
+            ai_msg = await llm.ainvoke(messages)
+        return self.handle_response(ai_msg)
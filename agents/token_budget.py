@@ -0,0 +1,105 @@
+import json
+
+# Fields of analysis_results dropped first when a prompt is over budget, least useful first
+LOW_VALUE_FIELDS = [
+    "sentence_similarity_summary",
+    "lexical_profile",
+    "tfidf_similarity",
+    "average_sentence_similarity",
+]
+
+_encoding = None
+_encoding_loaded = False
+
+
+def count_tokens(text):
+    """Token count with tiktoken when it is available, otherwise a ~4 chars/token estimate."""
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            # Not installed, or the encoding file cannot be fetched (offline)
+            _encoding = None
+        _encoding_loaded = True
+
+    if _encoding is not None:
+        return len(_encoding.encode(text))
+    return (len(text) + 3) // 4
+
+
+def compact_json(variables, over):
+    if "analysis_results" not in variables:
+        return None
+    compacted = json.dumps(json.loads(variables["analysis_results"]), separators=(",", ":"))
+    if compacted == variables["analysis_results"]:
+        return None
+    return {**variables, "analysis_results": compacted}
+
+
+def drop_low_value_fields(variables, over):
+    if "analysis_results" not in variables:
+        return None
+    results = json.loads(variables["analysis_results"])
+    for field in LOW_VALUE_FIELDS:
+        if field in results:
+            # One field per step, so no more is dropped than needed
+            del results[field]
+            return {**variables, "analysis_results": json.dumps(results, separators=(",", ":"))}
+    return None
+
+
+def trim_knowledge_base(variables, over):
+    knowledge_base = variables.get("knowledge_base")
+    if not knowledge_base:
+        return None
+
+    kb_tokens = count_tokens(knowledge_base)
+    keep_ratio = max(0.0, 1 - (over + 1) / kb_tokens)
+    cut = int(len(knowledge_base) * keep_ratio)
+    # Prefer cutting at a paragraph boundary
+    boundary = knowledge_base.rfind("\n\n", 0, cut)
+    trimmed = knowledge_base[:boundary if boundary > 0 else cut].rstrip()
+    if trimmed == knowledge_base:
+        return None
+    return {**variables, "knowledge_base": trimmed}
+
+
+# Ranked shrinking strategies, cheapest loss of information first
+STRATEGIES = [
+    ("compact_json", compact_json),
+    ("drop_low_value_fields", drop_low_value_fields),
+    ("trim_knowledge_base", trim_knowledge_base),
+]
+
+
+def fit_to_budget(render, variables, max_tokens):
+    """Shrink the prompt variables until the rendered prompt fits in max_tokens.
+
+    `render` turns the variables into the list of message strings sent to the
+    model. Returns the (possibly reduced) variables and a report of the token
+    counts and the reductions that were applied.
+    """
+    report = {
+        "budget": max_tokens,
+        # Non-string variables (e.g. scoring) are rendered with str() by format()
+        "variable_tokens": {name: count_tokens(str(value)) for name, value in variables.items()},
+        "reductions": [],
+    }
+    tokens = sum(count_tokens(text) for text in render(variables))
+    report["tokens_before"] = tokens
+
+    for name, strategy in STRATEGIES:
+        while tokens > max_tokens:
+            reduced = strategy(variables, tokens - max_tokens)
+            if reduced is None:
+                break
+            variables = reduced
+            new_tokens = sum(count_tokens(text) for text in render(variables))
+            report["reductions"].append({"strategy": name, "tokens_saved": tokens - new_tokens})
+            tokens = new_tokens
+
+    report["tokens_after"] = tokens
+    report["over_budget"] = tokens > max_tokens
+    return variables, report
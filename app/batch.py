@@ -0,0 +1,244 @@
+import os
+import csv
+import json
+import time
+import asyncio
+import argparse
+from agent_graph.graph import create_graph, compile_workflow
+from agent_graph.checkpointer import get_async_sqlite_checkpointer, get_run_config, arun_workflow
+from models.response_cache import ResponseCache
+from models.http_client import configure_timeouts
+from models.resilience import configure_retries
+from models.rate_limiter import configure_rate_limits
+from models.endpoint_pool import configure_balancing
+from tools.nlp_resources import warm_up as warm_up_nlp
+from tools.format_report import REPORT_SECTIONS
+
+
+def read_essays(input_path, id_field="id", text_field="essay"):
+    """Stream (essay_id, text) pairs from a JSONL or CSV file.
+
+    Rows without an id fall back to their position in the file, which stays
+    stable between runs as long as the input file is not reordered.
+    """
+    with open(input_path, 'r', encoding='utf-8', newline='') as file:
+        if input_path.lower().endswith(".csv"):
+            rows = csv.DictReader(file)
+        else:
+            rows = (json.loads(line) for line in file if line.strip())
+
+        for index, row in enumerate(rows):
+            essay_id = str(row.get(id_field) or index)
+            yield essay_id, row[text_field]
+
+
+def load_completed(output_path):
+    """Return the ids already graded successfully in a previous run."""
+    completed = set()
+    if not os.path.exists(output_path):
+        return completed
+
+    with open(output_path, 'r', encoding='utf-8') as file:
+        for line in file:
+            try:
+                row = json.loads(line)
+            except json.JSONDecodeError:
+                # A crash can leave a half-written last line behind
+                continue
+            if row.get("status") == "ok":
+                completed.add(row["id"])
+    return completed
+
+
+def build_result(essay_id, state, elapsed):
+    outputs = {}
+    report = None
+    for msg in state["messages"]:
+        if msg.role == "formatted_report":
+            report = msg.content
+            continue
+        # Only the graded sections of the report; the knowledge base, linguistic
+        # layer and similarity matrix would repeat large payloads on every row
+        if msg.role not in REPORT_SECTIONS:
+            continue
+        try:
+            outputs[msg.role] = json.loads(msg.content)
+        except json.JSONDecodeError:
+            outputs[msg.role] = msg.content
+
+    failures = state.get("failures") or []
+    if failures:
+        # Graded partially; not counted as done, so a rerun retries the failed nodes
+        status = "failed"
+    else:
+        status = "ok" if report else "incomplete"
+
+    return {
+        "id": essay_id,
+        "status": status,
+        "elapsed": round(elapsed, 3),
+        "outputs": outputs,
+        "failures": failures,
+        "report": report
+    }
+
+
+async def grade_essay(workflow, essay_id, text, recursion_limit):
+    start = time.perf_counter()
+    try:
+        # Essay ids double as checkpoint run ids, so a retried essay resumes at
+        # its first incomplete node when the workflow has a checkpointer
+        config = get_run_config(essay_id, recursion_limit)
+        state = await arun_workflow(workflow, {"user_input": text}, config)
+        return build_result(essay_id, state, time.perf_counter() - start)
+    except Exception as e:
+        return {
+            "id": essay_id,
+            "status": "error",
+            "elapsed": round(time.perf_counter() - start, 3),
+            "error": str(e)
+        }
+
+
+async def run_batch(workflow, input_path, output_path, concurrency=4, recursion_limit=40,
+                    id_field="id", text_field="essay"):
+    completed = load_completed(output_path)
+    if completed:
+        print(f"Resuming: {len(completed)} essays already graded in {output_path}")
+
+    semaphore = asyncio.Semaphore(concurrency)
+    pending = set()
+    counts = {"ok": 0, "failed": 0, "incomplete": 0, "error": 0, "skipped": 0}
+
+    with open(output_path, 'a', encoding='utf-8') as output_file:
+
+        async def worker(essay_id, text):
+            try:
+                result = await grade_essay(workflow, essay_id, text, recursion_limit)
+            finally:
+                semaphore.release()
+
+            # Each result is flushed as soon as it completes, so the output file
+            # doubles as the progress record for a resumed run
+            output_file.write(json.dumps(result) + "\n")
+            output_file.flush()
+            counts[result["status"]] += 1
+            print(f"[{result['status']}] {essay_id} ({result['elapsed']}s)")
+
+        for essay_id, text in read_essays(input_path, id_field, text_field):
+            if essay_id in completed:
+                counts["skipped"] += 1
+                continue
+
+            # Only read the next essay once a slot is free, so the input is
+            # streamed rather than loaded into memory up front
+            await semaphore.acquire()
+            task = asyncio.create_task(worker(essay_id, text))
+            pending.add(task)
+            task.add_done_callback(pending.discard)
+
+        if pending:
+            await asyncio.gather(*pending)
+
+    return counts
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Grade a file of IELTS essays without the UI.")
+    parser.add_argument("input", help="JSONL or CSV file with one essay per row")
+    parser.add_argument("output", help="JSONL file that receives one result row per essay")
+    parser.add_argument("--server", default="claude")
+    parser.add_argument("--model", default="claude-3-5-sonnet@20240620")
+    parser.add_argument("--model-endpoint", default=None,
+                        help="vLLM/Ollama server URL; separate several with commas to balance the load over them")
+    parser.add_argument("--balancing", choices=["least_outstanding", "latency"], default=None,
+                        help="How requests are spread over several servers")
+    parser.add_argument("--temperature", type=float, default=0)
+    parser.add_argument("--stop", default=None)
+    parser.add_argument("--prompt-layout", choices=["inline", "prefix"], default="inline",
+                        help="'prefix' puts the static instructions and knowledge base first so providers can cache them")
+    parser.add_argument("--token-budget", type=int, default=None,
+                        help="Maximum prompt tokens per agent call; larger prompts are shrunk to fit")
+    parser.add_argument("--grading-mode", choices=["separate", "fused"], default="separate",
+                        help="'fused' returns analysis, feedback and scoring from one LLM call instead of three")
+    parser.add_argument("--connect-timeout", type=float, default=None,
+                        help="Seconds to wait for a connection to the model server")
+    parser.add_argument("--read-timeout", type=float, default=None,
+                        help="Seconds to wait for a model response before failing the node")
+    parser.add_argument("--retries", type=int, default=None,
+                        help="Attempts per model request on rate limits, 5xx errors and timeouts")
+    parser.add_argument("--rpm", type=float, default=None,
+                        help="Requests per minute allowed by the provider's quota")
+    parser.add_argument("--tpm", type=float, default=None,
+                        help="Tokens per minute allowed by the provider's quota")
+    parser.add_argument("--hedge-server", default=None,
+                        help="Send slow calls (above the node's p95 latency) to this server as well; first answer wins")
+    parser.add_argument("--hedge-model", default=None)
+    parser.add_argument("--hedge-endpoint", default=None)
+    parser.add_argument("--concurrency", type=int, default=4,
+                        help="Maximum number of essays graded at the same time")
+    parser.add_argument("--recursion-limit", type=int, default=40)
+    parser.add_argument("--checkpoint-db", default=None,
+                        help="SQLite file for per-node checkpoints, so failed essays resume mid-graph")
+    parser.add_argument("--cache-db", default=None,
+                        help="SQLite file caching LLM responses and tool results, so regrading identical essays skips the work")
+    parser.add_argument("--id-field", default="id")
+    parser.add_argument("--text-field", default="essay")
+    return parser.parse_args()
+
+
+async def main(args):
+    timeouts = {name: value for name, value in (("connect", args.connect_timeout), ("read", args.read_timeout)) if value is not None}
+    if timeouts:
+        configure_timeouts(args.server, **timeouts)
+    quota = {name: value for name, value in (("rpm", args.rpm), ("tpm", args.tpm)) if value is not None}
+    if quota:
+        configure_rate_limits(args.server, **quota)
+    if args.balancing:
+        configure_balancing(strategy=args.balancing)
+    if args.retries is not None:
+        configure_retries(max_attempts=args.retries)
+    hedge_options = {name: value for name, value in (
+        ("server", args.hedge_server), ("model", args.hedge_model), ("model_endpoint", args.hedge_endpoint)
+    ) if value is not None}
+
+    # Load spaCy once, before the first essay
+    warm_up_nlp()
+
+    print("Creating graph and compiling workflow...")
+    cache = ResponseCache(db_path=args.cache_db) if args.cache_db else None
+    graph = create_graph(
+        server=args.server,
+        model=args.model,
+        stop=args.stop,
+        model_endpoint=args.model_endpoint,
+        temperature=args.temperature,
+        response_cache=cache,
+        tool_cache=cache,
+        prompt_layout=args.prompt_layout,
+        token_budget=args.token_budget,
+        grading_mode=args.grading_mode,
+        hedge=hedge_options or None
+    )
+    batch_options = dict(
+        concurrency=args.concurrency,
+        recursion_limit=args.recursion_limit,
+        id_field=args.id_field,
+        text_field=args.text_field
+    )
+
+    if not args.checkpoint_db:
+        workflow = compile_workflow(graph)
+        print("Graph and workflow created.")
+        return await run_batch(workflow, args.input, args.output, **batch_options)
+
+    # The async saver owns a database connection thread that must be closed
+    async with get_async_sqlite_checkpointer(args.checkpoint_db) as checkpointer:
+        workflow = compile_workflow(graph, checkpointer=checkpointer)
+        print("Graph and workflow created.")
+        return await run_batch(workflow, args.input, args.output, **batch_options)
+
+
+if __name__ == "__main__":
+    counts = asyncio.run(main(parse_args()))
+    print(f"Batch complete: {counts}")
@@ -1,9 +1,12 @@
 import os
-import json
 import yaml
 import chainlit as cl
 from chainlit.input_widget import TextInput, Slider, Select, NumberInput
 from agent_graph.graph import create_graph, compile_workflow
+from models.registry import clear_clients
+from models.response_cache import ResponseCache
+from utils.cancellation import CancellationToken, RunCancelled
+from tools.nlp_resources import warm_up as warm_up_nlp
 
 
 def update_config(serper_api_key, openai_llm_api_key, groq_llm_api_key, claud_llm_api_key, gemini_llm_api_key):
@@ -38,47 +41,47 @@ class ChatWorkflow:
     def __init__(self):
         self.workflow = None
         self.recursion_limit = 40
+        # Resubmitted essays (demos, regrade requests) are answered from memory
+        self.response_cache = ResponseCache()
 
     def build_workflow(self, server, model, model_endpoint, temperature, recursion_limit=40, stop=None):
+        # Pooled clients hold the previous API keys, so rebuild them
+        clear_clients()
         graph = create_graph(
             server=server, 
             model=model, 
             model_endpoint=model_endpoint,
             temperature=temperature,
-            stop=stop
+            stop=stop,
+            # Only deterministic settings give reusable answers
+            response_cache=self.response_cache if temperature == 0 else None
         )
         self.workflow = compile_workflow(graph)
         self.recursion_limit = recursion_limit
 
-    def invoke_workflow(self, message):
+    async def invoke_workflow(self, message, cancel_token=None):
         if not self.workflow:
             return "Workflow has not been built yet. Please update settings first."
-        
-        dict_inputs = {"research_question": message.content}
-        limit = {"recursion_limit": self.recursion_limit}
-        reporter_state = None
-
-        for event in self.workflow.stream(dict_inputs, limit):
-            next_agent = ""
-            if "router" in event.keys():
-                state = event["router"]
-                reviewer_state = state['router_response']
-                # print("\n\nREVIEWER_STATE:", reviewer_state)
-                reviewer_state_dict = json.loads(reviewer_state)
-                next_agent_value = reviewer_state_dict["next_agent"]
-                if isinstance(next_agent_value, list):
-                    next_agent = next_agent_value[-1]
-                else:
-                    next_agent = next_agent_value
-
-            if next_agent == "final_report":
-                # print("\n\nEVENT_DEBUG:", event)
-                state = event["router"]
-                reporter_state = state['reporter_response']
-                if isinstance(reporter_state, list):
-                    print("LIST:", "TRUE")
-                    reporter_state = reporter_state[-1]
-                return reporter_state.content if reporter_state else "No report available"
+
+        cancel_token = cancel_token or CancellationToken()
+        dict_inputs = {"user_input": message.content}
+        config = {"recursion_limit": self.recursion_limit, "configurable": {"cancel_token": cancel_token}}
+
+        try:
+            # Cancelling the token aborts the in-flight model requests and
+            # skips the nodes that have not started yet
+            return await cancel_token.run(self.stream_report(dict_inputs, config))
+        except RunCancelled:
+            return "Workflow was cancelled"
+
+    async def stream_report(self, dict_inputs, config):
+        # astream drives the agent nodes through their native async path, so
+        # no worker thread is held while waiting on the model servers
+        async for event in self.workflow.astream(dict_inputs, config):
+            if "report_generation" in event.keys():
+                state = event["report_generation"]
+                report = next((msg for msg in state.get("messages", []) if msg.role == "formatted_report"), None)
+                return report.content if report else "No report available"
 
         return "Workflow did not reach final report"
 
@@ -143,8 +146,8 @@ async def start():
             ),
             TextInput(
                 id='server_endpoint',
-                label='Your vLLM server endpoint:',
-                description="Your HTTPs endpoint for the vLLM server. Only use if you are using a custom server"
+                label='Your vLLM / Ollama server endpoint:',
+                description="Your HTTPs endpoint for the vLLM or Ollama server. Separate several servers with commas to spread the load over them"
             ),
             TextInput(
                 id='stop_token',
@@ -187,9 +190,29 @@ async def update_settings(settings):
     author = settings["llm_model"]
     await cl.Message(content="✅ Settings updated successfully, building workflow...").send()
     chat_workflow.build_workflow(server, model, model_endpoint, temperature, recursion_limit, stop)
+    # Load the NLP models (and build the word frequency table on the first run)
+    # now rather than during the first essay, on a worker thread so the other
+    # sessions' event loop keeps running
+    await cl.make_async(warm_up_nlp)()
     await cl.Message(content="😊 Workflow built successfully.").send()
 
 @cl.on_message
 async def main(message: cl.Message):
-    response = await cl.make_async(chat_workflow.invoke_workflow)(message)
-    await cl.Message(content=f"{response}", author=author).send()
\ No newline at end of file
+    # One token per session run, so leaving the chat stops this user's work only
+    cancel_token = CancellationToken()
+    cl.user_session.set("cancel_token", cancel_token)
+    response = await chat_workflow.invoke_workflow(message, cancel_token)
+    await cl.Message(content=f"{response}", author=author).send()
+
+def cancel_session_run():
+    cancel_token = cl.user_session.get("cancel_token")
+    if cancel_token:
+        cancel_token.cancel()
+
+@cl.on_stop
+def on_stop():
+    cancel_session_run()
+
+@cl.on_chat_end
+def on_chat_end():
+    cancel_session_run()
\ No newline at end of file
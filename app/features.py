@@ -0,0 +1,77 @@
+import csv
+import argparse
+from itertools import islice
+from app.batch import read_essays
+from tools.analysis_node1_tool import analyze_essays
+from tools.word_frequency import ZIPF_BANDS
+from tools.sentence_similarity import SIMILARITY_METRICS, SIMILARITY_METRIC
+
+# Per-essay scalar columns of analyze_essays written to the output file, followed
+# by the share of known words in each Zipf band
+FEATURE_COLUMNS = [
+    "word_count",
+    "sentence_count",
+    "grammar_error_count",
+    "readability_score",
+    "vocab_complexity",
+    "mean_zipf",
+    "rare_word_ratio",
+    "unknown_word_ratio",
+    "average_sentence_similarity",
+    "tfidf_similarity",
+]
+
+
+def extract_features(input_path, output_path, batch_size=32, n_process=1, chunk_size=1000, id_field="id", text_field="essay", metric=SIMILARITY_METRIC):
+    """Write the analysis_node1 features of every essay in the input file to a CSV file.
+
+    Essays are read and analysed chunk_size at a time, so memory stays bounded
+    on large inputs. Returns the number of essays processed.
+    """
+    essays = read_essays(input_path, id_field=id_field, text_field=text_field)
+    processed = 0
+    with open(output_path, 'w', encoding='utf-8', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(["id"] + FEATURE_COLUMNS + [f"zipf_{name}" for name, _ in ZIPF_BANDS])
+        while True:
+            chunk = list(islice(essays, chunk_size))
+            if not chunk:
+                break
+            ids, texts = zip(*chunk)
+            columns = analyze_essays(list(texts), batch_size=batch_size, n_process=n_process, metric=metric)
+            writer.writerows(zip(ids, *(columns[name].tolist() for name in FEATURE_COLUMNS), *columns["zipf_bands"].T.tolist()))
+            processed += len(chunk)
+            print(f"{processed} essays analysed")
+    return processed
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Extract the analysis_node1 features of many essays, without any LLM calls.")
+    parser.add_argument("input", help="JSONL or CSV file with one essay per row")
+    parser.add_argument("output", help="CSV file that receives one feature row per essay")
+    parser.add_argument("--batch-size", type=int, default=32,
+                        help="Essays per spaCy batch")
+    parser.add_argument("--n-process", type=int, default=1,
+                        help="spaCy worker processes; use the number of cores for large inputs")
+    parser.add_argument("--chunk-size", type=int, default=1000,
+                        help="Essays read and analysed at a time")
+    parser.add_argument("--similarity-metric", choices=SIMILARITY_METRICS, default=SIMILARITY_METRIC,
+                        help="How sentence pairs are compared; sequence_matcher is exact but slow")
+    parser.add_argument("--id-field", default="id")
+    parser.add_argument("--text-field", default="essay")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    count = extract_features(
+        args.input,
+        args.output,
+        batch_size=args.batch_size,
+        n_process=args.n_process,
+        chunk_size=args.chunk_size,
+        id_field=args.id_field,
+        text_field=args.text_field,
+        metric=args.similarity_metric
+    )
+    print(f"Feature extraction complete: {count} essays")
@@ -1,16 +1,23 @@
 import os
 from google.cloud import aiplatform
-from anthropic import AnthropicVertex
+from anthropic import AnthropicVertex, AsyncAnthropicVertex
 from utils.helper_functions import load_config
 from langchain_core.messages.human import HumanMessage
+from models.usage import anthropic_token_usage
+from models.structured_output import json_output_message
+from models.http_client import httpx_timeout
+from models.resilience import call_with_retries, acall_with_retries
+from models.rate_limiter import estimate_tokens
 import json
 from dotenv import load_dotenv
-import re
 
 load_dotenv()
 
+def response_tokens(response):
+    return response.usage.input_tokens + response.usage.output_tokens
+
 class ClaudVertexModel:
-    def __init__(self, temperature=0, model=None):
+    def __init__(self, temperature=0, model=None, prompt_caching=False):
         config_path = os.path.join(os.path.dirname(__file__), '..', 'config', 'config.yaml')
         load_config(config_path)
 
@@ -18,81 +25,100 @@ class ClaudVertexModel:
         self.project_id = os.getenv("GOOGLE_CLOUD_PROJECT")
         self.region = os.getenv("GOOGLE_CLOUD_REGION")
 
-        # Initialize Anthropic Vertex client
-        self.client = AnthropicVertex(project_id=self.project_id, region=self.region)
+        # Initialize Anthropic Vertex clients. The SDK does not retry itself:
+        # call_with_retries does, so every attempt goes through the shared
+        # rate limiter and a RateLimitError slows the provider down.
+        self.client = AnthropicVertex(project_id=self.project_id, region=self.region, max_retries=0)
+        self.async_client = AsyncAnthropicVertex(project_id=self.project_id, region=self.region, max_retries=0)
 
         self.temperature = temperature
         self.model = model
+        # Mark the system prompt as a cacheable prefix (Anthropic prompt caching)
+        self.prompt_caching = prompt_caching
 
-    def invoke(self, messages):
+    def system_blocks(self, text):
+        block = {"type": "text", "text": text}
+        if self.prompt_caching:
+            block["cache_control"] = {"type": "ephemeral"}
+        return [block]
+
+    def build_request(self, messages):
         system = messages[0]["content"]
         user = messages[1]["content"]
 
+        return {
+            "model": self.model,
+            "max_tokens": 1024,
+            "temperature": self.temperature,
+            "system": self.system_blocks(system),
+            "messages": [
+                {"role": "user", "content": user}
+            ]
+        }
+
+    def format_response(self, response):
+        response_content = response.content[0].text
+        return HumanMessage(content=response_content, response_metadata={"token_usage": anthropic_token_usage(response.usage)})
+
+    def format_error(self, e):
+        error_message = f"Error in invoking model! {str(e)}"
+        print("ERROR", error_message)
+        response = {"error": error_message}
+        return HumanMessage(content=json.dumps(response))
+
+    def invoke(self, messages):
         try:
-            response = self.client.messages.create(
-                model=self.model,
-                max_tokens=1024,
-                temperature=self.temperature,
-                messages=[
-                    {"role": "system", "content": system},
-                    {"role": "user", "content": user}
-                ]
+            request = self.build_request(messages)
+            response = call_with_retries(
+                "claude",
+                lambda: self.client.messages.create(**request, timeout=httpx_timeout("claude")),
+                estimate_tokens(json.dumps(request)),
+                usage=response_tokens
             )
+            return self.format_response(response)
+        except Exception as e:
+            return self.format_error(e)
 
-            response_content = response.content[0].text
-            response_formatted = HumanMessage(content=response_content)
-
-            return response_formatted
+    async def ainvoke(self, messages):
+        try:
+            request = self.build_request(messages)
+            response = await acall_with_retries(
+                "claude",
+                lambda: self.async_client.messages.create(**request, timeout=httpx_timeout("claude")),
+                estimate_tokens(json.dumps(request)),
+                usage=response_tokens
+            )
+            return self.format_response(response)
         except Exception as e:
-            error_message = f"Error in invoking model! {str(e)}"
-            print("ERROR", error_message)
-            response = {"error": error_message}
-            response_formatted = HumanMessage(content=json.dumps(response))
-            return response_formatted
+            return self.format_error(e)
 
 class ClaudVertexJSONModel(ClaudVertexModel):
-    def invoke(self, messages):
+    def build_request(self, messages):
         system = messages[0]["content"]
         user = messages[1]["content"]
 
-        try:
-            response = self.client.messages.create(
-                model=self.model,
-                max_tokens=4096,
-                temperature=self.temperature,
-                messages=[
-                    {
-                        "role": "user",
-                        "content": f"system:{system}. Your output must be json formatted. Just return the specified json format, do not prepend your response with anything. \n\n user:{user}"
-                    }
-                ]
-            )
-            response_content = response.content[0].text
-            with open('D:/VentureInternship/AI Agent/ProjectK/ModelResponse.txt','a') as file:
-                file.write(f'Model Response:\n{response_content}\n')
-
-            # Clean the response content
-            cleaned_content = re.sub(r'[\x00-\x1F\x7F-\x9F]', '', response_content)
-
-            try:
-                response = json.loads(cleaned_content)
-            except json.JSONDecodeError:
-                # If JSON parsing fails, return the raw text
-                response = {"raw_text": cleaned_content}
-
-            with open('D:/VentureInternship/AI Agent/ProjectK/ModelResponse.txt','a') as file:
-                file.write(f'Json Load Response:\n{response}\n')
-
-            response = json.dumps(response)
-            with open('D:/VentureInternship/AI Agent/ProjectK/ModelResponse.txt','a') as file:
-                file.write(f'Json Dumps Response:\n{response}\n')
-
-            response_formatted = HumanMessage(content=response)
-
-            return response_formatted
-        except Exception as e:
-            error_message = f"Error in invoking model! {str(e)}"
-            print("ERROR", error_message)
-            response = {"error": error_message}
-            response_formatted = HumanMessage(content=json.dumps(response))
-            return response_formatted
\ No newline at end of file
+        return {
+            "model": self.model,
+            "max_tokens": 4096,
+            "temperature": self.temperature,
+            "system": self.system_blocks(f"{system}. Your output must be json formatted. Just return the specified json format, do not prepend your response with anything."),
+            "messages": [
+                {
+                    "role": "user",
+                    "content": user
+                }
+            ]
+        }
+
+    def format_response(self, response):
+        response_content = response.content[0].text
+        response_usage = response.usage
+        with open('D:/VentureInternship/AI Agent/ProjectK/ModelResponse.txt','a') as file:
+            file.write(f'Model Response:\n{response_content}\n')
+
+        # Fenced, trailing-text or truncated JSON is repaired instead of failing
+        response = json_output_message(response_content, {"token_usage": anthropic_token_usage(response_usage)})
+        with open('D:/VentureInternship/AI Agent/ProjectK/ModelResponse.txt','a') as file:
+            file.write(f'Json Dumps Response:\n{response.content}\n')
+
+        return response
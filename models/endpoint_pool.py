@@ -0,0 +1,171 @@
+import os
+import time
+import random
+import threading
+import requests
+from urllib.parse import urlsplit
+from models.http_client import get_session
+
+# How requests are spread over the servers of a self-hosted model (vLLM, Ollama).
+# "least_outstanding" sends each request to the server with the fewest requests
+# in flight; "latency" also weighs in each server's recent response time, which
+# suits pools of unequal GPUs. A server failing eject_after times in a row is
+# left out for eject_seconds, and health checks run every health_interval seconds.
+balancing_settings = {
+    "strategy": os.environ.get("LLM_LB_STRATEGY", "least_outstanding"),
+    "eject_after": int(os.environ.get("LLM_LB_EJECT_AFTER", 3)),
+    "eject_seconds": float(os.environ.get("LLM_LB_EJECT_SECONDS", 30)),
+    "health_interval": float(os.environ.get("LLM_LB_HEALTH_INTERVAL", 10)),
+}
+
+STRATEGIES = ("least_outstanding", "latency")
+
+# Cheap endpoint of each server answering 200 when it can take requests
+HEALTH_PATHS = {"vllm": "health", "ollama": "api/version"}
+
+# Port each server listens on by default, added to an endpoint given as a bare
+# host like OLLAMA_HOST=127.0.0.1
+DEFAULT_PORTS = {"vllm": 8000, "ollama": 11434}
+
+_pools = {}
+_pools_lock = threading.Lock()
+_health_thread = None
+
+
+def configure_balancing(**settings):
+    unknown = settings.keys() - balancing_settings.keys()
+    if unknown:
+        raise ValueError(f"Unknown balancing settings: {sorted(unknown)}")
+    if settings.get("strategy", balancing_settings["strategy"]) not in STRATEGIES:
+        raise ValueError(f"Unknown balancing strategy: {settings['strategy']}")
+    balancing_settings.update(settings)
+
+
+def normalize_endpoint(endpoint, default_port=None):
+    """Base URL of a server given as a URL or as host[:port], ending with '/'.
+
+    Like Ollama's own client, a server given without a scheme is reached over
+    http on default_port unless it names a port; a full URL is kept as it is.
+    """
+    if "://" not in endpoint:
+        endpoint = f"http://{endpoint}"
+        parts = urlsplit(endpoint)
+        if default_port and parts.port is None:
+            endpoint = parts._replace(netloc=f"{parts.netloc}:{default_port}").geturl()
+    return endpoint if endpoint.endswith("/") else endpoint + "/"
+
+
+def parse_endpoints(model_endpoint, default_port=None):
+    """Base URLs from one URL, a comma-separated string or a list, normalised by normalize_endpoint."""
+    if isinstance(model_endpoint, str):
+        model_endpoint = model_endpoint.split(",")
+    endpoints = [endpoint.strip() for endpoint in model_endpoint or [] if endpoint and endpoint.strip()]
+    if not endpoints:
+        raise ValueError("No model endpoint given")
+    return tuple(normalize_endpoint(endpoint, default_port) for endpoint in endpoints)
+
+
+def get_endpoint_pool(provider, model_endpoint, path):
+    """The process-wide pool of these servers, shared by every client using them."""
+    key = (provider, parse_endpoints(model_endpoint, DEFAULT_PORTS.get(provider)), path)
+    pool = _pools.get(key)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(key)
+            if pool is None:
+                pool = _pools[key] = EndpointPool(provider, key[1], path)
+                if len(pool.endpoints) > 1:
+                    _start_health_checks()
+    return pool
+
+
+class Endpoint:
+    def __init__(self, base_url, path):
+        self.base_url = base_url
+        self.url = base_url + path
+        self.outstanding = 0
+        # Exponentially weighted response time in seconds, None until the first answer
+        self.latency = None
+        self.failures = 0
+        self.ejected_until = 0.0
+
+    def healthy(self, now):
+        return self.ejected_until <= now
+
+
+class EndpointPool:
+    """Servers of one model, picked per request by load and health."""
+
+    def __init__(self, provider, base_urls, path):
+        self.provider = provider
+        self.endpoints = [Endpoint(base_url, path) for base_url in base_urls]
+        self.lock = threading.Lock()
+
+    def score(self, endpoint):
+        if balancing_settings["strategy"] == "latency":
+            # Expected wait: queue length times response time; unmeasured servers go first
+            return (endpoint.outstanding + 1) * (endpoint.latency or 0.0)
+        return endpoint.outstanding
+
+    def acquire(self):
+        """Pick the server for the next request and count it as in flight."""
+        with self.lock:
+            now = time.monotonic()
+            candidates = [endpoint for endpoint in self.endpoints if endpoint.healthy(now)]
+            if not candidates:
+                # Every server is ejected: try the one coming back first rather than fail outright
+                candidates = [min(self.endpoints, key=lambda endpoint: endpoint.ejected_until)]
+            best = min(self.score(endpoint) for endpoint in candidates)
+            endpoint = random.choice([endpoint for endpoint in candidates if self.score(endpoint) == best])
+            endpoint.outstanding += 1
+            return endpoint
+
+    def release(self, endpoint, ok, seconds=None):
+        """End a request; ok=None (e.g. cancelled) says nothing about the server's health."""
+        with self.lock:
+            endpoint.outstanding -= 1
+            if ok:
+                endpoint.failures = 0
+                if seconds is not None:
+                    endpoint.latency = seconds if endpoint.latency is None else 0.7 * endpoint.latency + 0.3 * seconds
+            elif ok is not None:
+                endpoint.failures += 1
+                if endpoint.failures >= balancing_settings["eject_after"]:
+                    self.eject(endpoint)
+
+    def eject(self, endpoint):
+        if len(self.endpoints) == 1:
+            return
+        if endpoint.healthy(time.monotonic()):
+            print(f"Ejecting {self.provider} server {endpoint.base_url} for {balancing_settings['eject_seconds']:.0f}s")
+        endpoint.ejected_until = time.monotonic() + balancing_settings["eject_seconds"]
+
+    def check_health(self):
+        path = HEALTH_PATHS.get(self.provider, "")
+        for endpoint in self.endpoints:
+            try:
+                healthy = get_session().get(endpoint.base_url + path, timeout=2).ok
+            except requests.RequestException:
+                healthy = False
+            with self.lock:
+                if not healthy:
+                    self.eject(endpoint)
+                elif not endpoint.healthy(time.monotonic()):
+                    print(f"{self.provider} server {endpoint.base_url} is healthy again")
+                    endpoint.failures = 0
+                    endpoint.ejected_until = 0.0
+
+
+def _health_loop():
+    while True:
+        time.sleep(balancing_settings["health_interval"])
+        for pool in list(_pools.values()):
+            if len(pool.endpoints) > 1:
+                pool.check_health()
+
+
+def _start_health_checks():
+    global _health_thread
+    if _health_thread is None:
+        _health_thread = threading.Thread(target=_health_loop, name="endpoint-health", daemon=True)
+        _health_thread.start()
@@ -120,13 +120,17 @@
 #             return response_formatted
 
 import requests
+import httpx
+from models.resilience import post_with_retries, apost_with_retries
 import json
 import os
 from utils.helper_functions import load_config
 from langchain_core.messages.human import HumanMessage
+from models.usage import gemini_token_usage
+from models.structured_output import gemini_response_schema, json_output_message
 
 class GeminiJSONModel:
-    def __init__(self, temperature=0, model=None):
+    def __init__(self, temperature=0, model=None, guided_json=None):
         config_path = os.path.join(os.path.dirname(__file__), '..', 'config', 'config.yaml')
         load_config(config_path)
         self.api_key = os.environ.get("GEMINI_API_KEY")
@@ -136,8 +140,9 @@ class GeminiJSONModel:
         self.model_endpoint = f"https://generativelanguage.googleapis.com/v1beta/models/{model}:generateContent?key={self.api_key}"
         self.temperature = temperature
         self.model = model
+        self.guided_json = guided_json
 
-    def invoke(self, messages):
+    def build_payload(self, messages):
         system = messages[0]["content"]
         user = messages[1]["content"]
 
@@ -156,37 +161,57 @@ class GeminiJSONModel:
                 "temperature": self.temperature
             },
         }
+        if self.guided_json:
+            payload["generationConfig"]["response_schema"] = gemini_response_schema(self.guided_json)
+        return payload
 
-        try:
-            request_response = requests.post(
-                self.model_endpoint, 
-                headers=self.headers, 
-                data=json.dumps(payload)
-            )
-            
-            print("REQUEST RESPONSE", request_response.status_code)
-            # print("\n\nREQUEST RESPONSE HEADERS", request_response.headers)
-            # print("\n\nREQUEST RESPONSE TEXT", request_response.text)
-            
-            request_response_json = request_response.json()
+    def format_response(self, request_response):
+        print("REQUEST RESPONSE", request_response.status_code)
+        # print("\n\nREQUEST RESPONSE HEADERS", request_response.headers)
+        # print("\n\nREQUEST RESPONSE TEXT", request_response.text)
 
-            if 'candidates' not in request_response_json or not request_response_json['candidates']:
-                raise ValueError("No content in response")
+        request_response_json = request_response.json()
 
-            response_content = request_response_json['candidates'][0]['content']['parts'][0]['text']
-            
-            response = json.loads(response_content)
-            response = json.dumps(response)
+        if 'candidates' not in request_response_json or not request_response_json['candidates']:
+            raise ValueError("No content in response")
+
+        response_content = request_response_json['candidates'][0]['content']['parts'][0]['text']
 
-            response_formatted = HumanMessage(content=response)
+        return json_output_message(response_content, {"token_usage": gemini_token_usage(request_response_json.get('usageMetadata'))})
 
-            return response_formatted
+    def format_error(self, e):
+        error_message = f"Error in invoking model! {str(e) or type(e).__name__}"
+        print("ERROR", error_message)
+        response = {"error": error_message}
+        return HumanMessage(content=json.dumps(response))
+
+    def invoke(self, messages):
+        payload = self.build_payload(messages)
+
+        try:
+            request_response = post_with_retries(
+                "gemini",
+                self.model_endpoint,
+                headers=self.headers,
+                data=json.dumps(payload)
+            )
+            return self.format_response(request_response)
         except (requests.RequestException, ValueError, KeyError, json.JSONDecodeError) as e:
-            error_message = f"Error in invoking model! {str(e)}"
-            print("ERROR", error_message)
-            response = {"error": error_message}
-            response_formatted = HumanMessage(content=json.dumps(response))
-            return response_formatted
+            return self.format_error(e)
+
+    async def ainvoke(self, messages):
+        payload = self.build_payload(messages)
+
+        try:
+            request_response = await apost_with_retries(
+                "gemini",
+                self.model_endpoint,
+                headers=self.headers,
+                content=json.dumps(payload)
+            )
+            return self.format_response(request_response)
+        except (httpx.HTTPError, ValueError, KeyError, json.JSONDecodeError) as e:
+            return self.format_error(e)
 
 class GeminiModel:
     def __init__(self, temperature=0, model=None):
@@ -200,11 +225,11 @@ class GeminiModel:
         self.temperature = temperature
         self.model = model
 
-    def invoke(self, messages):
+    def build_payload(self, messages):
         system = messages[0]["content"]
         user = messages[1]["content"]
 
-        payload = {
+        return {
             "contents": [
                 {
                     "parts": [
@@ -219,27 +244,47 @@ class GeminiModel:
             },
         }
 
+    def format_response(self, request_response):
+        print("REQUEST RESPONSE", request_response.status_code)
+
+        request_response_json = request_response.json()
+
+        if 'candidates' not in request_response_json or not request_response_json['candidates']:
+            raise ValueError("No content in response")
+
+        response_content = request_response_json['candidates'][0]['content']['parts'][0]['text']
+        return HumanMessage(content=response_content, response_metadata={"token_usage": gemini_token_usage(request_response_json.get('usageMetadata'))})
+
+    def format_error(self, e):
+        error_message = f"Error in invoking model! {str(e) or type(e).__name__}"
+        print("ERROR", error_message)
+        response = {"error": error_message}
+        return HumanMessage(content=json.dumps(response))
+
+    def invoke(self, messages):
+        payload = self.build_payload(messages)
+
         try:
-            request_response = requests.post(
-                self.model_endpoint, 
-                headers=self.headers, 
+            request_response = post_with_retries(
+                "gemini",
+                self.model_endpoint,
+                headers=self.headers,
                 data=json.dumps(payload)
             )
-            
-            print("REQUEST RESPONSE", request_response.status_code)
-            
-            request_response_json = request_response.json()
-
-            if 'candidates' not in request_response_json or not request_response_json['candidates']:
-                raise ValueError("No content in response")
+            return self.format_response(request_response)
+        except (requests.RequestException, ValueError, KeyError, json.JSONDecodeError) as e:
+            return self.format_error(e)
 
-            response_content = request_response_json['candidates'][0]['content']['parts'][0]['text']
-            response_formatted = HumanMessage(content=response_content)
+    async def ainvoke(self, messages):
+        payload = self.build_payload(messages)
 
-            return response_formatted
-        except (requests.RequestException, ValueError, KeyError, json.JSONDecodeError) as e:
-            error_message = f"Error in invoking model! {str(e)}"
-            print("ERROR", error_message)
-            response = {"error": error_message}
-            response_formatted = HumanMessage(content=json.dumps(response))
-            return response_formatted
+        try:
+            request_response = await apost_with_retries(
+                "gemini",
+                self.model_endpoint,
+                headers=self.headers,
+                content=json.dumps(payload)
+            )
+            return self.format_response(request_response)
+        except (httpx.HTTPError, ValueError, KeyError, json.JSONDecodeError) as e:
+            return self.format_error(e)
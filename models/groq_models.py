@@ -1,29 +1,47 @@
 import requests
+import httpx
+from models.resilience import post_with_retries, apost_with_retries
 import json
 import os
 from utils.helper_functions import load_config
 from langchain_core.messages.human import HumanMessage
+from models.usage import openai_token_usage
+from models.structured_output import openai_response_format, json_output_message
+
+# Groq models supporting Structured Outputs (response_format "json_schema").
+# The others answer 400 to it and get "json_object" instead, with the schema
+# checked on receipt by ValidatedModel. GROQ_JSON_SCHEMA_MODELS adds models,
+# comma-separated.
+GROQ_JSON_SCHEMA_MODELS = {
+    "openai/gpt-oss-20b",
+    "openai/gpt-oss-120b",
+    "openai/gpt-oss-safeguard-20b",
+    "moonshotai/kimi-k2-instruct",
+    "moonshotai/kimi-k2-instruct-0905",
+    "meta-llama/llama-4-maverick-17b-128e-instruct",
+    "meta-llama/llama-4-scout-17b-16e-instruct",
+} | {model.strip() for model in os.environ.get("GROQ_JSON_SCHEMA_MODELS", "").split(",") if model.strip()}
 
 
 class GroqJSONModel:
-    def __init__(self, temperature=0, model=None):
+    def __init__(self, temperature=0, model=None, guided_json=None):
         config_path = os.path.join(os.path.dirname(__file__), '..', 'config', 'config.yaml')
         load_config(config_path)
         self.api_key = os.environ.get("GROQ_API_KEY")
         self.headers = {
-            'Content-Type': 'application/json', 
+            'Content-Type': 'application/json',
             'Authorization': f'Bearer {self.api_key}'
             }
         self.model_endpoint = "https://api.groq.com/openai/v1/chat/completions"
         self.temperature = temperature
         self.model = model
+        self.guided_json = guided_json
 
-    def invoke(self, messages):
-
+    def build_payload(self, messages):
         system = messages[0]["content"]
         user = messages[1]["content"]
 
-        payload = {
+        return {
             "model": self.model,
             "messages": [
                 {
@@ -32,41 +50,61 @@ class GroqJSONModel:
                 }
             ],
             "temperature": self.temperature,
-            "response_format": {"type": "json_object"}
+            # Groq does not enforce strict schemas, so the schema is sent as
+            # guidance where the model supports it and checked on receipt
+            "response_format": openai_response_format(self.guided_json, strict=False)
+            if self.guided_json and self.model in GROQ_JSON_SCHEMA_MODELS else {"type": "json_object"}
         }
-        
+
+    def format_response(self, request_response):
+        print("REQUEST RESPONSE", request_response.status_code)
+        # print("REQUEST RESPONSE HEADERS", request_response.headers)
+        # print("REQUEST RESPONSE TEXT", request_response.text)
+
+        request_response_json = request_response.json()
+        # print("REQUEST RESPONSE JSON", request_response_json)
+
+        if 'choices' not in request_response_json or len(request_response_json['choices']) == 0:
+            raise ValueError("No choices in response")
+
+        response_content = request_response_json['choices'][0]['message']['content']
+        # print("RESPONSE CONTENT", response_content)
+
+        return json_output_message(response_content, {"token_usage": openai_token_usage(request_response_json.get('usage'))})
+
+    def format_error(self, e):
+        error_message = f"Error in invoking model! {str(e) or type(e).__name__}"
+        print("ERROR", error_message)
+        response = {"error": error_message}
+        return HumanMessage(content=json.dumps(response))
+
+    def invoke(self, messages):
+        payload = self.build_payload(messages)
+
         try:
-            request_response = requests.post(
-                self.model_endpoint, 
-                headers=self.headers, 
+            request_response = post_with_retries(
+                "groq",
+                self.model_endpoint,
+                headers=self.headers,
                 data=json.dumps(payload)
             )
-            
-            print("REQUEST RESPONSE", request_response.status_code)
-            # print("REQUEST RESPONSE HEADERS", request_response.headers)
-            # print("REQUEST RESPONSE TEXT", request_response.text)
-            
-            request_response_json = request_response.json()
-            # print("REQUEST RESPONSE JSON", request_response_json)
-            
-            if 'choices' not in request_response_json or len(request_response_json['choices']) == 0:
-                raise ValueError("No choices in response")
-
-            response_content = request_response_json['choices'][0]['message']['content']
-            # print("RESPONSE CONTENT", response_content)
-            
-            response = json.loads(response_content)
-            response = json.dumps(response)
-
-            response_formatted = HumanMessage(content=response)
-
-            return response_formatted
-        except (requests.RequestException, ValueError, KeyError) as e:
-            error_message = f"Error in invoking model! {str(e)}"
-            print("ERROR", error_message)
-            response = {"error": error_message}
-            response_formatted = HumanMessage(content=json.dumps(response))
-            return response_formatted
+            return self.format_response(request_response)
+        except (requests.RequestException, KeyError, IndexError, ValueError) as e:
+            return self.format_error(e)
+
+    async def ainvoke(self, messages):
+        payload = self.build_payload(messages)
+
+        try:
+            request_response = await apost_with_retries(
+                "groq",
+                self.model_endpoint,
+                headers=self.headers,
+                content=json.dumps(payload)
+            )
+            return self.format_response(request_response)
+        except (httpx.HTTPError, KeyError, IndexError, ValueError) as e:
+            return self.format_error(e)
 
 class GroqModel:
     def __init__(self, temperature=0, model=None):
@@ -74,19 +112,18 @@ class GroqModel:
         load_config(config_path)
         self.api_key = os.environ.get("GROQ_API_KEY")
         self.headers = {
-            'Content-Type': 'application/json', 
+            'Content-Type': 'application/json',
             'Authorization': f'Bearer {self.api_key}'
             }
         self.model_endpoint = "https://api.groq.com/openai/v1/chat/completions"
         self.temperature = temperature
         self.model = model
 
-    def invoke(self, messages):
-
+    def build_payload(self, messages):
         system = messages[0]["content"]
         user = messages[1]["content"]
 
-        payload = {
+        return {
             "model": self.model,
             "messages": [
                 {
@@ -97,21 +134,41 @@ class GroqModel:
             "temperature": self.temperature,
         }
 
+    def format_response(self, request_response):
+        print("REQUEST RESPONSE", request_response)
+        request_response_json = request_response.json()
+        response = str(request_response_json['choices'][0]['message']['content'])
+
+        return HumanMessage(content=response, response_metadata={"token_usage": openai_token_usage(request_response_json.get('usage'))})
+
+    def format_error(self, e):
+        response = {"error": f"Error in invoking model! {str(e) or type(e).__name__}"}
+        return HumanMessage(content=json.dumps(response))
+
+    def invoke(self, messages):
+        payload = self.build_payload(messages)
+
         try:
-            request_response = requests.post(
-                self.model_endpoint, 
-                headers=self.headers, 
+            request_response = post_with_retries(
+                "groq",
+                self.model_endpoint,
+                headers=self.headers,
                 data=json.dumps(payload)
                 )
-            
-            print("REQUEST RESPONSE", request_response)
-            request_response_json = request_response.json()['choices'][0]['message']['content']
-            response = str(request_response_json)
-            
-            response_formatted = HumanMessage(content=response)
-
-            return response_formatted
-        except requests.RequestException as e:
-            response = {"error": f"Error in invoking model! {str(e)}"}
-            response_formatted = HumanMessage(content=response)
-            return response_formatted
\ No newline at end of file
+            return self.format_response(request_response)
+        except (requests.RequestException, KeyError, IndexError, ValueError) as e:
+            return self.format_error(e)
+
+    async def ainvoke(self, messages):
+        payload = self.build_payload(messages)
+
+        try:
+            request_response = await apost_with_retries(
+                "groq",
+                self.model_endpoint,
+                headers=self.headers,
+                content=json.dumps(payload)
+            )
+            return self.format_response(request_response)
+        except (httpx.HTTPError, KeyError, IndexError, ValueError) as e:
+            return self.format_error(e)
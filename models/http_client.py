@@ -0,0 +1,146 @@
+import os
+import asyncio
+import threading
+import weakref
+import contextvars
+from contextlib import contextmanager
+import requests
+import httpx
+from requests.adapters import HTTPAdapter
+
+# Connection pool settings shared by the raw-HTTP providers (Groq, Ollama,
+# vLLM, Gemini). Defaults can be overridden through the environment or
+# configure_http_pool().
+pool_settings = {
+    "max_connections": int(os.environ.get("LLM_HTTP_MAX_CONNECTIONS", 100)),
+    "max_keepalive_connections": int(os.environ.get("LLM_HTTP_MAX_KEEPALIVE", 20)),
+    "keepalive_expiry": float(os.environ.get("LLM_HTTP_KEEPALIVE_EXPIRY", 30)),
+    "http2": os.environ.get("LLM_HTTP2", "true").lower() == "true",
+}
+
+# Connect/read timeouts in seconds. "default" applies to every provider, and a
+# provider entry overrides single values of it. Without a read timeout a stalled
+# endpoint would hold its worker forever.
+timeout_settings = {
+    "default": {
+        "connect": float(os.environ.get("LLM_HTTP_CONNECT_TIMEOUT", 10)),
+        "read": float(os.environ.get("LLM_HTTP_READ_TIMEOUT", 120)),
+    },
+    # Local servers load the model on first use and generate more slowly
+    "ollama": {"read": float(os.environ.get("LLM_OLLAMA_READ_TIMEOUT", 300))},
+}
+
+# Per-call minimum set by a node with its own timeout (see call_timeout)
+_timeout_override = contextvars.ContextVar("llm_timeout_override", default=None)
+
+_session = None
+_session_lock = threading.Lock()
+# httpx.AsyncClient is bound to the event loop it was first used on
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def http2_available():
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def configure_http_pool(**settings):
+    """Update the pool settings; clients created afterwards pick them up."""
+    unknown = settings.keys() - pool_settings.keys()
+    if unknown:
+        raise ValueError(f"Unknown HTTP pool settings: {sorted(unknown)}")
+    pool_settings.update(settings)
+    reset_http_clients()
+
+
+def configure_timeouts(provider="default", **timeouts):
+    """Set the connect and/or read timeout of one provider, or of all with "default"."""
+    unknown = timeouts.keys() - {"connect", "read"}
+    if unknown:
+        raise ValueError(f"Unknown timeout settings: {sorted(unknown)}")
+    timeout_settings.setdefault(provider, {}).update(timeouts)
+
+
+def get_timeout(provider):
+    """(connect, read) timeout of the next call to this provider."""
+    timeout = {**timeout_settings["default"], **timeout_settings.get(provider, {})}
+    override = _timeout_override.get()
+    if override:
+        # A node's timeout only lengthens the provider's, so it never cuts short
+        # a slow provider (Ollama) or a timeout the user configured
+        for name, seconds in override.items():
+            timeout[name] = max(timeout[name], seconds)
+    return timeout["connect"], timeout["read"]
+
+
+def requests_timeout(provider):
+    return get_timeout(provider)
+
+
+def httpx_timeout(provider):
+    connect, read = get_timeout(provider)
+    return httpx.Timeout(read, connect=connect)
+
+
+@contextmanager
+def call_timeout(timeout):
+    """Give the calls made inside the block at least these timeouts, e.g. {"read": 300}.
+
+    Applies to the clients that read get_timeout on every call (raw HTTP and
+    Claude); ChatOpenAI fixes its timeout when the client is built, so it
+    keeps the provider's.
+    """
+    token = _timeout_override.set(timeout)
+    try:
+        yield
+    finally:
+        _timeout_override.reset(token)
+
+
+def get_session():
+    """Shared requests.Session keeping connections alive between calls."""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                # requests pools per host; pool_maxsize caps connections kept per host
+                adapter = HTTPAdapter(
+                    pool_connections=pool_settings["max_keepalive_connections"],
+                    pool_maxsize=pool_settings["max_connections"]
+                )
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                _session = session
+    return _session
+
+
+def get_async_client():
+    """Shared httpx.AsyncClient for the running event loop (HTTP/2 when h2 is installed)."""
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = httpx.AsyncClient(
+            http2=pool_settings["http2"] and http2_available(),
+            limits=httpx.Limits(
+                max_connections=pool_settings["max_connections"],
+                max_keepalive_connections=pool_settings["max_keepalive_connections"],
+                keepalive_expiry=pool_settings["keepalive_expiry"]
+            )
+        )
+        _async_clients[loop] = client
+    return client
+
+
+def reset_http_clients():
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+            _session = None
+    # Async clients can only be closed on their own loop; dropping them lets
+    # the next call on each loop build a client with the new settings
+    _async_clients.clear()
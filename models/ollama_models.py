@@ -1,87 +1,133 @@
+import os
 import requests
+import httpx
+from models.resilience import post_with_retries, apost_with_retries
 import json
 import ast
 from langchain_core.messages.human import HumanMessage
+from models.structured_output import json_output_message
+from models.endpoint_pool import get_endpoint_pool
+
+# Used when no endpoint is configured; several servers can be given as a list
+# or a comma-separated string. Ollama's usual host:port form without a scheme
+# works too (see models.endpoint_pool.normalize_endpoint).
+DEFAULT_OLLAMA_ENDPOINT = os.environ.get("OLLAMA_HOST", "http://localhost:11434/")
 
 class OllamaJSONModel:
-    def __init__(self, temperature=0, model="llama3:instruct"):
+    def __init__(self, temperature=0, model="llama3:instruct", guided_json=None, model_endpoint=None):
         self.headers = {"Content-Type": "application/json"}
-        self.model_endpoint = "http://localhost:11434/api/generate"
+        self.model_endpoint = get_endpoint_pool("ollama", model_endpoint or DEFAULT_OLLAMA_ENDPOINT, "api/generate")
         self.temperature = temperature
         self.model = model
+        self.guided_json = guided_json
 
-    def invoke(self, messages):
-
+    def build_payload(self, messages):
         system = messages[0]["content"]
         user = messages[1]["content"]
 
-        payload = {
+        return {
                 "model": self.model,
                 "prompt": user,
-                "format": "json",
+                # A schema constrains the output to it (structured outputs)
+                "format": self.guided_json or "json",
                 "system": system,
                 "stream": False,
                 "temperature": 0,
             }
-        
+
+    def format_response(self, request_response):
+        print("REQUEST RESPONSE", request_response)
+        request_response_json = request_response.json()
+        # print("REQUEST RESPONSE JSON", request_response_json)
+        return json_output_message(request_response_json['response'])
+
+    def format_error(self, e):
+        response = {"error": f"Error in invoking model! {str(e) or type(e).__name__}"}
+        return HumanMessage(content=json.dumps(response))
+
+    def invoke(self, messages):
+        payload = self.build_payload(messages)
+
         try:
-            request_response = requests.post(
-                self.model_endpoint, 
-                headers=self.headers, 
+            request_response = post_with_retries(
+                "ollama",
+                self.model_endpoint,
+                headers=self.headers,
                 data=json.dumps(payload)
                 )
-            
-            print("REQUEST RESPONSE", request_response)
-            request_response_json = request_response.json()
-            # print("REQUEST RESPONSE JSON", request_response_json)
-            response = json.loads(request_response_json['response'])
-            response = json.dumps(response)
+            return self.format_response(request_response)
+        except requests.RequestException as e:
+            return self.format_error(e)
 
-            response_formatted = HumanMessage(content=response)
+    async def ainvoke(self, messages):
+        payload = self.build_payload(messages)
 
-            return response_formatted
-        except requests.RequestException as e:
-            response = {"error": f"Error in invoking model! {str(e)}"}
-            response_formatted = HumanMessage(content=response)
-            return response_formatted
+        try:
+            request_response = await apost_with_retries(
+                "ollama",
+                self.model_endpoint,
+                headers=self.headers,
+                content=json.dumps(payload)
+            )
+            return self.format_response(request_response)
+        except httpx.HTTPError as e:
+            return self.format_error(e)
 
 class OllamaModel:
-    def __init__(self, temperature=0, model="llama3:instruct"):
+    def __init__(self, temperature=0, model="llama3:instruct", model_endpoint=None):
         self.headers = {"Content-Type": "application/json"}
-        self.model_endpoint = "http://localhost:11434/api/generate"
+        self.model_endpoint = get_endpoint_pool("ollama", model_endpoint or DEFAULT_OLLAMA_ENDPOINT, "api/generate")
         self.temperature = temperature
         self.model = model
 
-    def invoke(self, messages):
-
+    def build_payload(self, messages):
         system = messages[0]["content"]
         user = messages[1]["content"]
 
-        payload = {
+        return {
                 "model": self.model,
                 "prompt": user,
                 "system": system,
                 "stream": False,
                 "temperature": 0,
             }
-        
+
+    def format_response(self, request_response):
+        print("REQUEST RESPONSE JSON", request_response)
+
+        request_response_json = request_response.json()['response']
+        response = str(request_response_json)
+
+        return HumanMessage(content=response)
+
+    def format_error(self, e):
+        response = {"error": f"Error in invoking model! {str(e) or type(e).__name__}"}
+        return HumanMessage(content=json.dumps(response))
+
+    def invoke(self, messages):
+        payload = self.build_payload(messages)
+
         try:
-            request_response = requests.post(
-                self.model_endpoint, 
-                headers=self.headers, 
+            request_response = post_with_retries(
+                "ollama",
+                self.model_endpoint,
+                headers=self.headers,
                 data=json.dumps(payload)
                 )
-            
-            print("REQUEST RESPONSE JSON", request_response)
-
-            request_response_json = request_response.json()['response']
-            response = str(request_response_json)
-            
-            response_formatted = HumanMessage(content=response)
-
-            return response_formatted
+            return self.format_response(request_response)
         except requests.RequestException as e:
-            response = {"error": f"Error in invoking model! {str(e)}"}
-            response_formatted = HumanMessage(content=response)
-            return response_formatted
+            return self.format_error(e)
+
+    async def ainvoke(self, messages):
+        payload = self.build_payload(messages)
 
+        try:
+            request_response = await apost_with_retries(
+                "ollama",
+                self.model_endpoint,
+                headers=self.headers,
+                content=json.dumps(payload)
+            )
+            return self.format_response(request_response)
+        except httpx.HTTPError as e:
+            return self.format_error(e)
@@ -1,23 +1,70 @@
 from langchain_openai import ChatOpenAI
+from langchain_core.messages.human import HumanMessage
 from utils.helper_functions import load_config
+from models.structured_output import openai_response_format
+from models.http_client import httpx_timeout
+from models.resilience import call_with_retries, acall_with_retries
+from models.rate_limiter import estimate_tokens
+import json
 import os
 
 config_path = os.path.join(os.path.dirname(__file__), '..', 'config', 'config.yaml')
 load_config(config_path)
 
 
+def response_tokens(ai_msg):
+    return (ai_msg.response_metadata.get("token_usage") or {}).get("total_tokens")
+
+
+class OpenAIModel:
+    """ChatOpenAI with every attempt admitted by the shared rate limiter.
+
+    The SDK does not retry itself; call_with_retries does, so a RateLimitError
+    lowers the provider's concurrency like a 429 of the raw-HTTP clients. A
+    call that still fails returns an {"error": ...} message like the other
+    clients, which the agent records as a provider_error failure.
+    """
+
+    def __init__(self, llm):
+        self.llm = llm
+
+    def format_error(self, e):
+        error_message = f"Error in invoking model! {str(e) or type(e).__name__}"
+        print("ERROR", error_message)
+        return HumanMessage(content=json.dumps({"error": error_message}))
+
+    def invoke(self, messages):
+        try:
+            return call_with_retries("openai", lambda: self.llm.invoke(messages), estimate_tokens(json.dumps(messages, default=str)), usage=response_tokens)
+        except Exception as e:
+            return self.format_error(e)
+
+    async def ainvoke(self, messages):
+        try:
+            return await acall_with_retries("openai", lambda: self.llm.ainvoke(messages), estimate_tokens(json.dumps(messages, default=str)), usage=response_tokens)
+        except Exception as e:
+            return self.format_error(e)
+
+
 def get_open_ai(temperature=0, model='gpt-3.5-turbo'):
 
     llm = ChatOpenAI(
     model=model,
     temperature = temperature,
+    # Fixed when the client is built; per-node timeouts (call_timeout) do not apply here
+    timeout=httpx_timeout("openai"),
+    max_retries=0,
 )
-    return llm
+    return OpenAIModel(llm)
 
-def get_open_ai_json(temperature=0, model='gpt-3.5-turbo'):
+def get_open_ai_json(temperature=0, model='gpt-3.5-turbo', guided_json=None):
+    response_format = openai_response_format(guided_json) if guided_json else {"type": "json_object"}
     llm = ChatOpenAI(
     model=model,
     temperature = temperature,
-    model_kwargs={"response_format": {"type": "json_object"}},
+    # Fixed when the client is built; per-node timeouts (call_timeout) do not apply here
+    timeout=httpx_timeout("openai"),
+    max_retries=0,
+    model_kwargs={"response_format": response_format},
 )
-    return llm
+    return OpenAIModel(llm)
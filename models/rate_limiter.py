@@ -0,0 +1,205 @@
+import os
+import time
+import asyncio
+import threading
+from collections import deque
+from urllib.parse import urlsplit
+
+# Quota of each provider. rpm/tpm are requests and tokens per minute (None for
+# no limit); concurrency is the starting number of requests in flight, which
+# adapts between min_concurrency and max_concurrency. "default" applies to
+# every provider and a provider entry overrides single values of it, like
+# timeout_settings in models.http_client. LLM_<PROVIDER>_RPM / _TPM set them
+# from the environment, e.g. LLM_GROQ_TPM=6000.
+rate_limit_settings = {
+    "default": {"rpm": None, "tpm": None, "concurrency": 8, "min_concurrency": 1, "max_concurrency": 64},
+}
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def configure_rate_limits(provider="default", **limits):
+    """Set the quota of one provider, or of all with "default"; replaces the live limiters."""
+    unknown = limits.keys() - rate_limit_settings["default"].keys()
+    if unknown:
+        raise ValueError(f"Unknown rate limit settings: {sorted(unknown)}")
+    rate_limit_settings.setdefault(provider, {}).update(limits)
+    with _limiters_lock:
+        _limiters.clear()
+
+
+def limit_settings(provider):
+    settings = {**rate_limit_settings["default"], **rate_limit_settings.get(provider, {})}
+    for name in ("rpm", "tpm"):
+        value = os.environ.get(f"LLM_{provider.upper()}_{name.upper()}")
+        if value and name not in rate_limit_settings.get(provider, {}):
+            settings[name] = float(value)
+    return settings
+
+
+def get_rate_limiter(provider, url=None):
+    """The process-wide limiter of a provider, shared by all its clients and event loops.
+
+    Limiters are kept per host: a hosted API has a single one, while every
+    self-hosted vLLM/Ollama server gets its own concurrency.
+    """
+    key = (provider, urlsplit(url).netloc if url else None)
+    limiter = _limiters.get(key)
+    if limiter is None:
+        with _limiters_lock:
+            limiter = _limiters.get(key)
+            if limiter is None:
+                limiter = _limiters[key] = ProviderLimiter(provider, **limit_settings(provider))
+    return limiter
+
+
+class TokenBucket:
+    """Refills at `per_minute` units a minute, holding at most one minute's worth.
+
+    reserve() always takes its units and returns how long the caller must wait
+    for them; the balance can go negative, so waiting callers queue up in the
+    order they reserved instead of racing for the next refill.
+    """
+
+    def __init__(self, per_minute):
+        self.rate = per_minute / 60.0
+        self.capacity = float(per_minute)
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def reserve(self, amount, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+        # A request larger than the whole bucket would otherwise wait forever
+        self.level -= min(amount, self.capacity)
+        return max(0.0, -self.level / self.rate)
+
+    def refund(self, amount):
+        self.level = min(self.capacity, self.level + amount)
+
+
+class ProviderLimiter:
+    """Token buckets on requests and tokens per minute, plus AIMD concurrency.
+
+    The number of requests in flight grows by one after a full window of
+    successful calls that used it, and halves on a 429/503 or timeout; a
+    Retry-After also pauses the provider for that long. Throughput settles just
+    under the quota instead of oscillating through bursts of 429s.
+
+    acquire() returns the time the call was admitted, which release() takes
+    back as `started`. The calls that were already in flight when the limit was
+    halved were sent at the old rate, so their 429s belong to the same burst
+    and do not halve it again; only a call admitted after the decrease can.
+    """
+
+    def __init__(self, provider, rpm=None, tpm=None, concurrency=8, min_concurrency=1, max_concurrency=64):
+        self.provider = provider
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens = TokenBucket(tpm) if tpm else None
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.limit = float(min(max(concurrency, min_concurrency), max_concurrency))
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self.decreased_at = float("-inf")
+        self.lock = threading.Condition()
+        # Async callers wait on a future of their own loop, woken thread-safely
+        self._async_waiters = deque()
+
+    def _admission_delay(self, tokens):
+        with self.lock:
+            now = time.monotonic()
+            delay = self.paused_until - now
+            if self.requests:
+                delay = max(delay, self.requests.reserve(1, now))
+            if self.tokens and tokens:
+                delay = max(delay, self.tokens.reserve(tokens, now))
+            return max(0.0, delay)
+
+    def _try_enter(self):
+        if self.in_flight < int(self.limit):
+            self.in_flight += 1
+            return True
+        return False
+
+    def acquire(self, tokens=0):
+        delay = self._admission_delay(tokens)
+        if delay:
+            time.sleep(delay)
+        with self.lock:
+            while not self._try_enter():
+                self.lock.wait()
+        return time.monotonic()
+
+    async def aacquire(self, tokens=0):
+        delay = self._admission_delay(tokens)
+        if delay:
+            await asyncio.sleep(delay)
+        loop = asyncio.get_running_loop()
+        while True:
+            with self.lock:
+                if self._try_enter():
+                    return time.monotonic()
+                waiter = loop.create_future()
+                self._async_waiters.append((loop, waiter))
+            await waiter
+
+    def release(self, outcome, retry_after=None, tokens_reserved=0, tokens_used=None, started=None):
+        """End a call: outcome is "ok", "throttled" or "error" (neither speeds up nor slows down).
+
+        started is what acquire() returned; without it every throttled call
+        counts as a new congestion event.
+        """
+        with self.lock:
+            now = time.monotonic()
+            saturated = self.in_flight >= int(self.limit)
+            self.in_flight -= 1
+            if outcome == "throttled":
+                if retry_after is not None:
+                    self.paused_until = max(self.paused_until, now + retry_after)
+                if started is None or started >= self.decreased_at:
+                    self.limit = max(self.min_concurrency, self.limit / 2)
+                    self.decreased_at = now
+                    print(f"{self.provider} is throttling, concurrency lowered to {int(self.limit)}")
+            elif outcome == "ok" and saturated:
+                # Probe upward only when the current limit was actually reached
+                self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+            if self.tokens and tokens_used is not None:
+                # The reservation was an estimate; settle it with the reported usage
+                self.tokens.refund(tokens_reserved - tokens_used)
+            self.lock.notify_all()
+            waiters, self._async_waiters = self._async_waiters, deque()
+        for loop, waiter in waiters:
+            loop.call_soon_threadsafe(_wake, waiter)
+
+
+def _wake(waiter):
+    # The waiting task may have been cancelled in the meantime
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+def estimate_tokens(body):
+    """Rough size of a request body in tokens (~4 characters each), for the tpm bucket."""
+    return (len(body or "") + 3) // 4
+
+
+def reported_tokens(response):
+    """Total tokens a provider response reports using, or None."""
+    try:
+        data = response.json()
+    except ValueError:
+        return None
+    if not isinstance(data, dict):
+        return None
+    if data.get("usage"):
+        # OpenAI-compatible (Groq, vLLM)
+        usage = data["usage"]
+        return usage.get("total_tokens") or (usage.get("prompt_tokens", 0) + usage.get("completion_tokens", 0))
+    if data.get("usageMetadata"):
+        return data["usageMetadata"].get("totalTokenCount")
+    if "eval_count" in data:
+        # Ollama
+        return data.get("prompt_eval_count", 0) + data["eval_count"]
+    return None
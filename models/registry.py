@@ -0,0 +1,101 @@
+import json
+import threading
+from models.openai_models import get_open_ai, get_open_ai_json
+from models.ollama_models import OllamaModel, OllamaJSONModel
+from models.vllm_models import VllmJSONModel, VllmModel
+from models.groq_models import GroqModel, GroqJSONModel
+from models.claude_models import ClaudVertexModel, ClaudVertexJSONModel
+from models.gemini_models import GeminiModel, GeminiJSONModel
+
+# Process-wide pool of model clients. The clients keep no per-call state, so a
+# single instance per configuration is shared by every node, thread and task.
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def build_client(server, model, temperature=0, model_endpoint=None, json_model=True, stop=None, guided_json=None, prompt_caching=False):
+    if server == 'openai':
+        return get_open_ai_json(model=model, temperature=temperature, guided_json=guided_json) if json_model else get_open_ai(model=model, temperature=temperature)
+    if server == 'ollama':
+        return OllamaJSONModel(
+            model=model,
+            temperature=temperature,
+            guided_json=guided_json,
+            model_endpoint=model_endpoint
+        ) if json_model else OllamaModel(
+            model=model,
+            temperature=temperature,
+            model_endpoint=model_endpoint
+        )
+    if server == 'vllm':
+        return VllmJSONModel(
+            model=model,
+            guided_json=guided_json,
+            stop=stop,
+            model_endpoint=model_endpoint,
+            temperature=temperature
+        ) if json_model else VllmModel(
+            model=model,
+            model_endpoint=model_endpoint,
+            stop=stop,
+            temperature=temperature
+        )
+    if server == 'groq':
+        return GroqJSONModel(
+            model=model,
+            temperature=temperature,
+            guided_json=guided_json
+        ) if json_model else GroqModel(
+            model=model,
+            temperature=temperature
+        )
+    if server == 'claude':
+        return ClaudVertexJSONModel(
+            model=model,
+            temperature=temperature,
+            prompt_caching=prompt_caching
+        ) if json_model else ClaudVertexModel(
+            model=model,
+            temperature=temperature,
+            prompt_caching=prompt_caching
+        )
+    if server == 'gemini':
+        return GeminiJSONModel(
+            model=model,
+            temperature=temperature,
+            guided_json=guided_json
+        ) if json_model else GeminiModel(
+            model=model,
+            temperature=temperature
+        )
+
+
+def get_client(server, model, temperature=0, model_endpoint=None, json_model=True, stop=None, guided_json=None, prompt_caching=False):
+    """Return the shared client for this configuration, creating it on first use."""
+    key = (
+        server,
+        model,
+        temperature,
+        # A list of servers is not hashable
+        tuple(model_endpoint) if isinstance(model_endpoint, list) else model_endpoint,
+        json_model,
+        stop,
+        json.dumps(guided_json, sort_keys=True) if guided_json is not None else None,
+        prompt_caching
+    )
+
+    client = _clients.get(key)
+    if client is None:
+        with _clients_lock:
+            # Another thread may have built it while we waited for the lock
+            client = _clients.get(key)
+            if client is None:
+                client = build_client(server, model, temperature, model_endpoint, json_model, stop, guided_json, prompt_caching)
+                _clients[key] = client
+    return client
+
+
+def clear_clients():
+    """Drop every pooled client, e.g. after the API keys have changed."""
+    with _clients_lock:
+        _clients.clear()
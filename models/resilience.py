@@ -0,0 +1,313 @@
+import os
+import time
+import random
+import asyncio
+import threading
+import contextvars
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from email.utils import parsedate_to_datetime
+import requests
+import httpx
+from models.http_client import get_session, get_async_client, requests_timeout, httpx_timeout
+from models.response_cache import is_error_response
+from models.rate_limiter import get_rate_limiter, estimate_tokens, reported_tokens
+from models.endpoint_pool import EndpointPool
+
+# Retry policy of the model HTTP calls. Delays are in seconds; the n-th retry
+# waits a random time up to min(max_delay, base_delay * 2**n) ("full jitter").
+retry_settings = {
+    "max_attempts": int(os.environ.get("LLM_RETRY_ATTEMPTS", 3)),
+    "base_delay": float(os.environ.get("LLM_RETRY_BASE_DELAY", 0.5)),
+    "max_delay": float(os.environ.get("LLM_RETRY_MAX_DELAY", 20)),
+}
+
+# Rate limited, timed out or temporarily unavailable (529 is Anthropic's
+# "overloaded"); anything else will not succeed on a second try
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504, 529}
+
+
+def configure_retries(**settings):
+    unknown = settings.keys() - retry_settings.keys()
+    if unknown:
+        raise ValueError(f"Unknown retry settings: {sorted(unknown)}")
+    retry_settings.update(settings)
+
+
+def parse_retry_after(headers):
+    """Seconds requested by a Retry-After header (delta-seconds or HTTP date), or None."""
+    value = headers.get("Retry-After") if headers else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt, retry_after=None):
+    delay = random.uniform(0, min(retry_settings["max_delay"], retry_settings["base_delay"] * 2 ** attempt))
+    # The server's own hint wins when it asks for longer
+    return max(delay, retry_after) if retry_after is not None else delay
+
+
+def response_outcome(status_code):
+    """How a response counts for the provider's adaptive concurrency."""
+    if status_code in (429, 503, 529):
+        return "throttled"
+    return "ok" if status_code < 400 else "error"
+
+
+def post_with_retries(provider, url, **kwargs):
+    """POST through the shared session, retrying 429/5xx responses and timeouts.
+
+    Every attempt is admitted by the provider's rate limiter first. `url` may
+    also be an EndpointPool, which picks the server of each attempt, so a
+    retry goes to the least loaded healthy server.
+
+    Raises requests.HTTPError for a final error status, so every provider
+    reports it through its usual error path.
+    """
+    attempts = retry_settings["max_attempts"]
+    tokens = estimate_tokens(kwargs.get("data"))
+    for attempt in range(attempts):
+        endpoint = url.acquire() if isinstance(url, EndpointPool) else None
+        request_url = endpoint.url if endpoint else url
+        limiter = get_rate_limiter(provider, request_url)
+        started = limiter.acquire(tokens)
+        start = time.perf_counter()
+        try:
+            response = get_session().post(request_url, timeout=requests_timeout(provider), **kwargs)
+        except BaseException as e:
+            limiter.release("throttled" if isinstance(e, requests.Timeout) else "error", started=started)
+            if endpoint:
+                url.release(endpoint, None if not isinstance(e, Exception) else False)
+            if not isinstance(e, (requests.Timeout, requests.ConnectionError)) or attempt == attempts - 1:
+                raise
+            print(f"{provider} request failed ({type(e).__name__}), retrying")
+            time.sleep(backoff_delay(attempt))
+            continue
+
+        retry_after = parse_retry_after(response.headers)
+        limiter.release(response_outcome(response.status_code), retry_after, tokens, reported_tokens(response), started)
+        if endpoint:
+            url.release(endpoint, response.status_code < 500, time.perf_counter() - start)
+        if response.status_code in RETRYABLE_STATUS and attempt < attempts - 1:
+            print(f"{provider} returned {response.status_code}, retrying")
+            time.sleep(backoff_delay(attempt, retry_after))
+            continue
+        response.raise_for_status()
+        return response
+
+
+async def apost_with_retries(provider, url, **kwargs):
+    """Async counterpart of post_with_retries, on the loop's shared httpx client."""
+    attempts = retry_settings["max_attempts"]
+    tokens = estimate_tokens(kwargs.get("content"))
+    for attempt in range(attempts):
+        endpoint = url.acquire() if isinstance(url, EndpointPool) else None
+        request_url = endpoint.url if endpoint else url
+        limiter = get_rate_limiter(provider, request_url)
+        try:
+            started = await limiter.aacquire(tokens)
+        except BaseException:
+            if endpoint:
+                url.release(endpoint, None)
+            raise
+        start = time.perf_counter()
+        try:
+            response = await get_async_client().post(request_url, timeout=httpx_timeout(provider), **kwargs)
+        except BaseException as e:
+            # Also releases the slot when the call is cancelled
+            limiter.release("throttled" if isinstance(e, httpx.TimeoutException) else "error", started=started)
+            if endpoint:
+                url.release(endpoint, None if not isinstance(e, Exception) else False)
+            # Timeouts, refused connections and dropped streams are retried
+            if not isinstance(e, httpx.TransportError) or attempt == attempts - 1:
+                raise
+            print(f"{provider} request failed ({type(e).__name__}), retrying")
+            await asyncio.sleep(backoff_delay(attempt))
+            continue
+
+        retry_after = parse_retry_after(response.headers)
+        limiter.release(response_outcome(response.status_code), retry_after, tokens, reported_tokens(response), started)
+        if endpoint:
+            url.release(endpoint, response.status_code < 500, time.perf_counter() - start)
+        if response.status_code in RETRYABLE_STATUS and attempt < attempts - 1:
+            print(f"{provider} returned {response.status_code}, retrying")
+            await asyncio.sleep(backoff_delay(attempt, retry_after))
+            continue
+        response.raise_for_status()
+        return response
+
+
+def sdk_error_outcome(error):
+    """(limiter outcome, retryable, Retry-After) of an exception raised by the Anthropic or OpenAI SDK.
+
+    Their status errors (RateLimitError is a 429) carry the status code and the
+    httpx response; connection errors and timeouts are raised from httpx's own.
+    """
+    status_code = getattr(error, "status_code", None)
+    if isinstance(status_code, int):
+        response = getattr(error, "response", None)
+        retry_after = parse_retry_after(getattr(response, "headers", None))
+        return response_outcome(status_code), status_code in RETRYABLE_STATUS, retry_after
+    cause = error.__cause__ or error
+    if isinstance(cause, httpx.TimeoutException):
+        return "throttled", True, None
+    return "error", isinstance(cause, httpx.TransportError), None
+
+
+def call_with_retries(provider, call, tokens=0, usage=None):
+    """Run an SDK call under the provider's rate limiter, retrying like post_with_retries.
+
+    For the clients built on an SDK (Claude, OpenAI), whose own retries are
+    turned off so that every attempt is admitted by the limiter. usage(result)
+    returns the tokens the call reported, settling the tpm reservation.
+    """
+    attempts = retry_settings["max_attempts"]
+    limiter = get_rate_limiter(provider)
+    for attempt in range(attempts):
+        started = limiter.acquire(tokens)
+        try:
+            result = call()
+        except BaseException as e:
+            outcome, retryable, retry_after = sdk_error_outcome(e) if isinstance(e, Exception) else ("error", False, None)
+            limiter.release(outcome, retry_after, started=started)
+            if not retryable or attempt == attempts - 1:
+                raise
+            print(f"{provider} request failed ({type(e).__name__}), retrying")
+            time.sleep(backoff_delay(attempt, retry_after))
+            continue
+        limiter.release("ok", None, tokens, usage(result) if usage else None, started)
+        return result
+
+
+async def acall_with_retries(provider, call, tokens=0, usage=None):
+    """Async counterpart of call_with_retries; call returns the SDK coroutine."""
+    attempts = retry_settings["max_attempts"]
+    limiter = get_rate_limiter(provider)
+    for attempt in range(attempts):
+        started = await limiter.aacquire(tokens)
+        try:
+            result = await call()
+        except BaseException as e:
+            # Also releases the slot when the call is cancelled
+            outcome, retryable, retry_after = sdk_error_outcome(e) if isinstance(e, Exception) else ("error", False, None)
+            limiter.release(outcome, retry_after, started=started)
+            if not retryable or attempt == attempts - 1:
+                raise
+            print(f"{provider} request failed ({type(e).__name__}), retrying")
+            await asyncio.sleep(backoff_delay(attempt, retry_after))
+            continue
+        limiter.release("ok", None, tokens, usage(result) if usage else None, started)
+        return result
+
+
+class LatencyTracker:
+    """Rolling window of call latencies per key (node), for hedging decisions."""
+
+    def __init__(self, window=200):
+        self.window = window
+        self.samples = {}
+        self.lock = threading.Lock()
+
+    def record(self, key, seconds):
+        with self.lock:
+            self.samples.setdefault(key, deque(maxlen=self.window)).append(seconds)
+
+    def percentile(self, key, q, min_samples=20):
+        """The q-th percentile latency of the key, or None until enough calls were seen."""
+        with self.lock:
+            samples = sorted(self.samples.get(key, ()))
+        if len(samples) < min_samples:
+            return None
+        return samples[min(len(samples) - 1, int(q / 100 * len(samples)))]
+
+
+node_latencies = LatencyTracker()
+# Runs only the hedged requests, so they never queue behind the slow primaries they race
+_hedge_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="hedge")
+
+
+def run_in_thread(function, *args):
+    """Run function on a thread of its own and return a Future of its result."""
+    future = Future()
+
+    def run():
+        try:
+            future.set_result(function(*args))
+        except BaseException as e:
+            future.set_exception(e)
+
+    threading.Thread(target=run, daemon=True, name="hedge-primary").start()
+    return future
+
+
+class HedgedModel:
+    """Sends a duplicate request to a second client when the first one is slow.
+
+    The hedge fires once the primary call has been running longer than the
+    node's p95 latency (hedge_after seconds until enough calls were seen) and
+    the first usable answer wins. Only slow calls are duplicated, so the extra
+    load stays around 5% while the tail latency follows the faster backend.
+    """
+
+    def __init__(self, llm, hedge_llm, key, hedge_after=30.0, percentile=95):
+        self.llm = llm
+        self.hedge_llm = hedge_llm
+        self.key = key
+        self.hedge_after = hedge_after
+        self.percentile = percentile
+
+    def hedge_delay(self):
+        p95 = node_latencies.percentile(self.key, self.percentile)
+        return p95 if p95 is not None else self.hedge_after
+
+    def invoke(self, messages):
+        start = time.perf_counter()
+        # The primary gets a thread of its own rather than a pool worker; both
+        # run in a copy of this context, keeping the node's timeout
+        calls = {run_in_thread(contextvars.copy_context().run, self.llm.invoke, messages)}
+        done, _ = wait(calls, timeout=self.hedge_delay())
+        if not done:
+            print(f"{self.key} slower than its p95, sending a hedged request")
+            calls.add(_hedge_executor.submit(contextvars.copy_context().run, self.hedge_llm.invoke, messages))
+
+        # A blocking request cannot be aborted; the loser's answer is dropped
+        while calls:
+            done, calls = wait(calls, return_when=FIRST_COMPLETED)
+            result = first_usable([call.result() for call in done])
+            if not is_error_response(result.content):
+                break
+        node_latencies.record(self.key, time.perf_counter() - start)
+        return result
+
+    async def ainvoke(self, messages):
+        start = time.perf_counter()
+        calls = {asyncio.ensure_future(self.llm.ainvoke(messages))}
+        try:
+            done, _ = await asyncio.wait(calls, timeout=self.hedge_delay())
+            if not done:
+                print(f"{self.key} slower than its p95, sending a hedged request")
+                calls.add(asyncio.ensure_future(self.hedge_llm.ainvoke(messages)))
+
+            while calls:
+                done, calls = await asyncio.wait(calls, return_when=asyncio.FIRST_COMPLETED)
+                result = first_usable([call.result() for call in done])
+                if not is_error_response(result.content):
+                    break
+        finally:
+            # Aborts the slower request, also when this call is cancelled
+            for call in calls:
+                call.cancel()
+        node_latencies.record(self.key, time.perf_counter() - start)
+        return result
+
+
+def first_usable(results):
+    return next((result for result in results if not is_error_response(result.content)), results[0])
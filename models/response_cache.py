@@ -0,0 +1,165 @@
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from langchain_core.messages.human import HumanMessage
+
+
+def schema_hash(guided_json):
+    if guided_json is None:
+        return None
+    return hashlib.sha256(json.dumps(guided_json, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def make_cache_key(server, model, temperature, system, user, json_model, guided_json=None, model_endpoint=None):
+    """Content address of one LLM call.
+
+    Cache hits skip the schema validation, so the key covers the schema: a
+    response validated against an older schema is never returned. The
+    endpoint is included too, since different servers may serve different
+    weights under one model name.
+    """
+    raw = json.dumps(
+        [server, model, temperature, system, user, json_model, schema_hash(guided_json), model_endpoint],
+        ensure_ascii=False
+    )
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+def is_error_response(content):
+    # Provider failures come back as {"error": ...}; those must never be cached
+    try:
+        parsed = json.loads(content)
+    except (TypeError, ValueError):
+        return False
+    return isinstance(parsed, dict) and "error" in parsed
+
+
+class ResponseCache:
+    """Two-tier cache of LLM responses: an in-memory LRU in front of an optional SQLite file.
+
+    The disk tier is bounded by `max_disk_bytes`; when it grows past the limit
+    the least recently used entries are evicted.
+    """
+
+    def __init__(self, max_memory_entries=256, db_path=None, max_disk_bytes=256 * 1024 * 1024):
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_bytes = max_disk_bytes
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0}
+
+        self.conn = None
+        if db_path:
+            self.conn = sqlite3.connect(db_path, check_same_thread=False)
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, content TEXT NOT NULL, size INTEGER NOT NULL, last_access REAL NOT NULL)"
+            )
+            self.conn.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)")
+            self.conn.commit()
+
+    def get(self, key):
+        with self.lock:
+            content = self.memory.get(key)
+            if content is not None:
+                self.memory.move_to_end(key)
+                self.stats["memory_hits"] += 1
+                return content
+
+            if self.conn is not None:
+                row = self.conn.execute("SELECT content FROM responses WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    self.conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key))
+                    self.conn.commit()
+                    self.remember(key, row[0])
+                    self.stats["disk_hits"] += 1
+                    return row[0]
+
+            self.stats["misses"] += 1
+            return None
+
+    def put(self, key, content):
+        with self.lock:
+            self.remember(key, content)
+            if self.conn is None:
+                return
+
+            size = len(content.encode('utf-8'))
+            self.conn.execute(
+                "INSERT OR REPLACE INTO responses (key, content, size, last_access) VALUES (?, ?, ?, ?)",
+                (key, content, size, time.time())
+            )
+            self.evict_disk()
+            self.conn.commit()
+
+    def remember(self, key, content):
+        self.memory[key] = content
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_memory_entries:
+            self.memory.popitem(last=False)
+
+    def evict_disk(self):
+        total = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_disk_bytes:
+            return
+
+        for key, size in self.conn.execute("SELECT key, size FROM responses ORDER BY last_access").fetchall():
+            self.conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            total -= size
+            if total <= self.max_disk_bytes:
+                break
+
+    def clear(self):
+        with self.lock:
+            self.memory.clear()
+            if self.conn is not None:
+                self.conn.execute("DELETE FROM responses")
+                self.conn.commit()
+
+
+class CachedModel:
+    """Wraps a model client so repeated identical calls are answered from a ResponseCache."""
+
+    def __init__(self, llm, cache, server, model, temperature, json_model, guided_json=None, model_endpoint=None):
+        self.llm = llm
+        self.cache = cache
+        self.server = server
+        self.model = model
+        self.temperature = temperature
+        self.json_model = json_model
+        self.guided_json = guided_json
+        self.model_endpoint = model_endpoint
+
+    def cache_key(self, messages):
+        return make_cache_key(
+            self.server,
+            self.model,
+            self.temperature,
+            messages[0]["content"],
+            messages[1]["content"],
+            self.json_model,
+            self.guided_json,
+            self.model_endpoint
+        )
+
+    def store(self, key, ai_msg):
+        if not is_error_response(ai_msg.content):
+            self.cache.put(key, ai_msg.content)
+        return ai_msg
+
+    def invoke(self, messages):
+        key = self.cache_key(messages)
+        content = self.cache.get(key)
+        if content is not None:
+            return HumanMessage(content=content)
+        return self.store(key, self.llm.invoke(messages))
+
+    async def ainvoke(self, messages):
+        key = self.cache_key(messages)
+        content = self.cache.get(key)
+        if content is not None:
+            return HumanMessage(content=content)
+        return self.store(key, await self.llm.ainvoke(messages))
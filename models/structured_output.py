@@ -0,0 +1,278 @@
+import json
+from langchain_core.messages.human import HumanMessage
+
+_CLOSERS = {"{": "}", "[": "]"}
+_STRING_CONTROL_ESCAPES = {"\n": "\\n", "\r": "\\r", "\t": "\\t"}
+
+
+def repair_json(text):
+    """Cut the outermost JSON value out of model output and fix its common defects.
+
+    A single scan skips any prose or code fence around the value, escapes raw
+    control characters inside strings, drops trailing commas and closes
+    strings, arrays and objects left open by a truncated response. Returns the
+    repaired JSON text, or None when the output holds no JSON value.
+    """
+    # The node outputs are objects, so an object wins over an earlier bracket in prose
+    start = text.find("{")
+    if start < 0:
+        start = text.find("[")
+    if start < 0:
+        return None
+
+    out = []
+    stack = []
+    in_string = False
+    escape = False
+    # Output length and open containers at the last comma, to drop a truncated member
+    last_comma = None
+    for ch in text[start:]:
+        if in_string:
+            if escape:
+                escape = False
+                out.append(ch)
+            elif ch == "\\":
+                escape = True
+                out.append(ch)
+            elif ch == '"':
+                in_string = False
+                out.append(ch)
+            elif ch < " ":
+                out.append(_STRING_CONTROL_ESCAPES.get(ch, ""))
+            else:
+                out.append(ch)
+        elif ch == '"':
+            in_string = True
+            out.append(ch)
+        elif ch in _CLOSERS:
+            stack.append(_CLOSERS[ch])
+            out.append(ch)
+        elif ch in "}]":
+            _strip_trailing_comma(out)
+            # A mismatched closer is replaced by the one that is expected
+            out.append(stack.pop())
+            if not stack:
+                return "".join(out)
+        elif ch == ",":
+            last_comma = (len(out), list(stack))
+            out.append(ch)
+        elif ch == "`":
+            # Closing code fence of a truncated response
+            continue
+        else:
+            out.append(ch)
+
+    # Truncated: close what is still open
+    if in_string:
+        if escape:
+            out.pop()
+        out.append('"')
+    repaired = _close(out, stack)
+    if _is_json(repaired) or last_comma is None:
+        return repaired
+    # The last member was cut mid-way (e.g. a key without its value); drop it
+    length, open_stack = last_comma
+    return _close(out[:length], open_stack)
+
+
+def _strip_trailing_comma(out):
+    while out and out[-1].isspace():
+        out.pop()
+    if out and out[-1] == ",":
+        out.pop()
+
+
+def _close(out, stack):
+    out = list(out)
+    _strip_trailing_comma(out)
+    return "".join(out) + "".join(reversed(stack))
+
+
+def _is_json(text):
+    try:
+        json.loads(text)
+    except ValueError:
+        return False
+    return True
+
+
+def parse_json_output(text):
+    """Parse model output as JSON, repairing it when needed. Raises ValueError when it cannot."""
+    try:
+        return json.loads(text)
+    except ValueError:
+        pass
+    repaired = repair_json(text)
+    if repaired is None:
+        raise ValueError("No JSON value found in the model output")
+    return json.loads(repaired)
+
+
+def json_output_message(text, response_metadata=None):
+    """Message of a JSON model: the parsed output, or an error carrying the raw text for a re-ask."""
+    try:
+        response = parse_json_output(text)
+    except ValueError:
+        response = {"error": "Model output is not valid JSON", "raw_response": text}
+    return HumanMessage(content=json.dumps(response), response_metadata=response_metadata or {})
+
+
+_TYPES = {
+    "object": dict,
+    "array": list,
+    "string": str,
+    "number": (int, float),
+    "integer": int,
+    "boolean": bool,
+}
+
+
+def schema_errors(value, schema, path="$"):
+    """Check value against the JSON schema subset used by the *_guided_json prompts.
+
+    Supports type, properties, required, items, enum, minimum and maximum.
+    Returns the list of errors, empty when the value matches.
+    """
+    expected = schema.get("type")
+    if expected in _TYPES:
+        # bool is an int subclass, but never a valid number
+        if not isinstance(value, _TYPES[expected]) or (isinstance(value, bool) and expected != "boolean"):
+            return [f"{path}: expected {expected}, got {type(value).__name__}"]
+
+    errors = []
+    if "enum" in schema and value not in schema["enum"]:
+        errors.append(f"{path}: {value!r} is not one of {schema['enum']}")
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        if "minimum" in schema and value < schema["minimum"]:
+            errors.append(f"{path}: {value} is below the minimum {schema['minimum']}")
+        if "maximum" in schema and value > schema["maximum"]:
+            errors.append(f"{path}: {value} is above the maximum {schema['maximum']}")
+    if isinstance(value, dict):
+        for key in schema.get("required", []):
+            if key not in value:
+                errors.append(f"{path}: missing required key '{key}'")
+        for key, subschema in schema.get("properties", {}).items():
+            if key in value:
+                errors.extend(schema_errors(value[key], subschema, f"{path}.{key}"))
+    if isinstance(value, list) and "items" in schema:
+        for i, item in enumerate(value):
+            errors.extend(schema_errors(item, schema["items"], f"{path}[{i}]"))
+    return errors
+
+
+def strict_json_schema(schema):
+    """Copy of the schema that OpenAI strict structured outputs accept (closed objects)."""
+    if not isinstance(schema, dict):
+        return schema
+    strict = {key: strict_json_schema(value) if key == "items" else value for key, value in schema.items()}
+    if "properties" in schema:
+        strict["properties"] = {key: strict_json_schema(value) for key, value in schema["properties"].items()}
+    if schema.get("type") == "object":
+        strict["additionalProperties"] = False
+    return strict
+
+
+def openai_response_format(schema, strict=True, name="response"):
+    """response_format of the OpenAI-compatible chat APIs constraining the output to the schema."""
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "name": name,
+            "schema": strict_json_schema(schema) if strict else schema,
+            "strict": strict
+        }
+    }
+
+
+# Keys of the OpenAPI schema subset accepted as Gemini's responseSchema
+_GEMINI_SCHEMA_KEYS = {"description", "nullable", "enum", "required", "minimum", "maximum", "minItems", "maxItems"}
+
+
+def gemini_response_schema(schema):
+    """Convert a JSON schema to Gemini's responseSchema format."""
+    converted = {key: value for key, value in schema.items() if key in _GEMINI_SCHEMA_KEYS}
+    if "type" in schema:
+        converted["type"] = schema["type"].upper()
+    if "properties" in schema:
+        converted["properties"] = {key: gemini_response_schema(value) for key, value in schema["properties"].items()}
+    if "items" in schema:
+        converted["items"] = gemini_response_schema(schema["items"])
+    return converted
+
+
+repair_prompt = """
+Your previous response could not be used because it does not match the required JSON schema.
+Return the corrected JSON object only, keeping the content of your previous response.
+
+Problems found:
+{errors}
+
+JSON schema:
+{schema}
+"""
+
+
+class ValidatedModel:
+    """Wraps a JSON model client and checks every response against the node's schema.
+
+    An output that cannot be parsed or does not match is sent back once with a
+    short repair request listing the problems, instead of the whole prompt. If
+    the answer still does not match it is turned into an error response, so
+    it is neither cached nor passed on as if it were a valid result.
+    """
+
+    def __init__(self, llm, schema, max_repairs=1):
+        self.llm = llm
+        self.schema = schema
+        self.max_repairs = max_repairs
+
+    def check(self, ai_msg):
+        """Returns the schema errors and the output to repair, or ([], None) when there is nothing to fix."""
+        try:
+            parsed = json.loads(ai_msg.content)
+        except (TypeError, ValueError):
+            return ["$: response is not valid JSON"], ai_msg.content
+
+        if isinstance(parsed, dict) and "error" in parsed:
+            if "raw_response" in parsed:
+                # The provider could not parse the output; the text may still be fixable
+                return ["$: response is not valid JSON"], parsed["raw_response"]
+            # Other provider failures are already error responses
+            return [], None
+        return schema_errors(parsed, self.schema), ai_msg.content
+
+    def repair_messages(self, output, errors):
+        return [
+            {"role": "system", "content": repair_prompt.format(
+                errors="\n".join(f"- {error}" for error in errors[:10]),
+                schema=json.dumps(self.schema)
+            )},
+            {"role": "user", "content": output}
+        ]
+
+    def failed(self, ai_msg, errors):
+        print("SCHEMA VALIDATION FAILED", errors[:5])
+        response = {"error": "Response does not match the expected schema", "schema_errors": errors[:10]}
+        return HumanMessage(content=json.dumps(response), response_metadata=ai_msg.response_metadata)
+
+    def invoke(self, messages):
+        ai_msg = self.llm.invoke(messages)
+        errors, output = self.check(ai_msg)
+        for _ in range(self.max_repairs):
+            if not errors:
+                break
+            print("RE-ASKING FOR A VALID RESPONSE", errors[:5])
+            ai_msg = self.llm.invoke(self.repair_messages(output, errors))
+            errors, output = self.check(ai_msg)
+        return self.failed(ai_msg, errors) if errors else ai_msg
+
+    async def ainvoke(self, messages):
+        ai_msg = await self.llm.ainvoke(messages)
+        errors, output = self.check(ai_msg)
+        for _ in range(self.max_repairs):
+            if not errors:
+                break
+            print("RE-ASKING FOR A VALID RESPONSE", errors[:5])
+            ai_msg = await self.llm.ainvoke(self.repair_messages(output, errors))
+            errors, output = self.check(ai_msg)
+        return self.failed(ai_msg, errors) if errors else ai_msg
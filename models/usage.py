@@ -0,0 +1,42 @@
+def make_token_usage(prompt_tokens=None, completion_tokens=None, cached_tokens=0):
+    """Token usage in the OpenAI shape, which every client reports under response_metadata["token_usage"]."""
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "prompt_tokens_details": {"cached_tokens": cached_tokens or 0},
+    }
+
+
+def openai_token_usage(usage):
+    # OpenAI, Groq and vLLM (with prefix caching) share this response format
+    usage = usage or {}
+    details = usage.get("prompt_tokens_details") or {}
+    return make_token_usage(usage.get("prompt_tokens"), usage.get("completion_tokens"), details.get("cached_tokens"))
+
+
+def anthropic_token_usage(usage):
+    cache_read = getattr(usage, "cache_read_input_tokens", None) or 0
+    cache_write = getattr(usage, "cache_creation_input_tokens", None) or 0
+    return make_token_usage(usage.input_tokens + cache_read + cache_write, usage.output_tokens, cache_read)
+
+
+def gemini_token_usage(usage_metadata):
+    usage_metadata = usage_metadata or {}
+    return make_token_usage(
+        usage_metadata.get("promptTokenCount"),
+        usage_metadata.get("candidatesTokenCount"),
+        usage_metadata.get("cachedContentTokenCount")
+    )
+
+
+def get_token_usage(ai_msg):
+    """Flat usage summary of a model response, or None when the client did not report one."""
+    usage = (getattr(ai_msg, "response_metadata", None) or {}).get("token_usage")
+    if not usage:
+        return None
+    details = usage.get("prompt_tokens_details") or {}
+    return {
+        "prompt_tokens": usage.get("prompt_tokens"),
+        "completion_tokens": usage.get("completion_tokens"),
+        "cached_tokens": details.get("cached_tokens") or 0,
+    }
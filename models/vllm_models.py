@@ -1,18 +1,23 @@
 import requests
+import httpx
+from models.resilience import post_with_retries, apost_with_retries
+from models.endpoint_pool import get_endpoint_pool
 import json
 from langchain_core.messages.human import HumanMessage
+from models.usage import openai_token_usage
+from models.structured_output import json_output_message
 
 class VllmJSONModel:
     def __init__(self, temperature=0, model="llama3:instruct", model_endpoint=None, guided_json=None, stop=None):
         self.headers = {"Content-Type": "application/json"}
-        self.model_endpoint = model_endpoint + 'v1/chat/completions'
+        # One server or several (list or comma-separated), balanced per request
+        self.model_endpoint = get_endpoint_pool("vllm", model_endpoint, 'v1/chat/completions')
         self.temperature = temperature
         self.model = model
         self.guided_json = guided_json
         self.stop = stop
 
-    def invoke(self, messages):
-
+    def build_payload(self, messages):
         system = messages[0]["content"]
         user = messages[1]["content"]
 
@@ -35,7 +40,6 @@ class VllmJSONModel:
         else:
             payload = {
                 "model": self.model,
-                "response_format": {"type": "json_object"},
                 "messages": [
                     {
                         "role": "system",
@@ -50,38 +54,63 @@ class VllmJSONModel:
                 "stop": self.stop,
                 "guided_json": self.guided_json
             }
-        
+            # vLLM accepts only one guided decoding mode per request; the schema
+            # already implies JSON output
+            if self.guided_json is None:
+                payload["response_format"] = {"type": "json_object"}
+        return payload
+
+    def format_response(self, request_response):
+        print("REQUEST RESPONSE", request_response)
+        request_response_json = request_response.json()
+        # print("REQUEST RESPONSE JSON", request_response_json)
+        response = request_response_json['choices'][0]['message']['content']
+
+        # Cached prompt tokens are reported when the server runs with --enable-prefix-caching
+        return json_output_message(response, {"token_usage": openai_token_usage(request_response_json.get('usage'))})
+
+    def format_error(self, e):
+        response = {"error": f"Error in invoking model! {str(e) or type(e).__name__}"}
+        return HumanMessage(content=json.dumps(response))
+
+    def invoke(self, messages):
+        payload = self.build_payload(messages)
+
         try:
-            request_response = requests.post(
-                self.model_endpoint, 
-                headers=self.headers, 
+            request_response = post_with_retries(
+                "vllm",
+                self.model_endpoint,
+                headers=self.headers,
                 data=json.dumps(payload)
                 )
-            
-            print("REQUEST RESPONSE", request_response)
-            request_response_json = request_response.json()
-            # print("REQUEST RESPONSE JSON", request_response_json)
-            response = json.loads(request_response_json['choices'][0]['message']['content'])
-            response = json.dumps(response)
+            return self.format_response(request_response)
+        except (requests.RequestException, KeyError, IndexError, ValueError) as e:
+            return self.format_error(e)
 
-            response_formatted = HumanMessage(content=response)
+    async def ainvoke(self, messages):
+        payload = self.build_payload(messages)
 
-            return response_formatted
-        except requests.RequestException as e:
-            response = {"error": f"Error in invoking model! {str(e)}"}
-            response_formatted = HumanMessage(content=response)
-            return response_formatted
+        try:
+            request_response = await apost_with_retries(
+                "vllm",
+                self.model_endpoint,
+                headers=self.headers,
+                content=json.dumps(payload)
+            )
+            return self.format_response(request_response)
+        except (httpx.HTTPError, KeyError, IndexError, ValueError) as e:
+            return self.format_error(e)
 
 class VllmModel:
     def __init__(self, temperature=0, model="llama3:instruct", model_endpoint=None, stop=None):
         self.headers = {"Content-Type": "application/json"}
-        self.model_endpoint = model_endpoint + 'v1/chat/completions'
+        # One server or several (list or comma-separated), balanced per request
+        self.model_endpoint = get_endpoint_pool("vllm", model_endpoint, 'v1/chat/completions')
         self.temperature = temperature
         self.model = model
         self.stop = stop
 
-    def invoke(self, messages):
-
+    def build_payload(self, messages):
         system = messages[0]["content"]
         user = messages[1]["content"]
 
@@ -116,22 +145,43 @@ class VllmModel:
                 "temperature": 0,
                 "stop": self.stop,
             }
-        
+        return payload
+
+    def format_response(self, request_response):
+        print("REQUEST RESPONSE", request_response)
+        request_response_json = request_response.json()
+        response = str(request_response_json['choices'][0]['message']['content'])
+
+        return HumanMessage(content=response, response_metadata={"token_usage": openai_token_usage(request_response_json.get('usage'))})
+
+    def format_error(self, e):
+        response = {"error": f"Error in invoking model! {str(e) or type(e).__name__}"}
+        return HumanMessage(content=json.dumps(response))
+
+    def invoke(self, messages):
+        payload = self.build_payload(messages)
+
         try:
-            request_response = requests.post(
-                self.model_endpoint, 
-                headers=self.headers, 
+            request_response = post_with_retries(
+                "vllm",
+                self.model_endpoint,
+                headers=self.headers,
                 data=json.dumps(payload)
                 )
-            
-            print("REQUEST RESPONSE", request_response)
-            request_response_json = request_response.json()['choices'][0]['message']['content']
-            response = str(request_response_json)
-            
-            response_formatted = HumanMessage(content=response)
-
-            return response_formatted
-        except requests.RequestException as e:
-            response = {"error": f"Error in invoking model! {str(e)}"}
-            response_formatted = HumanMessage(content=response)
-            return response_formatted
\ No newline at end of file
+            return self.format_response(request_response)
+        except (requests.RequestException, KeyError, IndexError, ValueError) as e:
+            return self.format_error(e)
+
+    async def ainvoke(self, messages):
+        payload = self.build_payload(messages)
+
+        try:
+            request_response = await apost_with_retries(
+                "vllm",
+                self.model_endpoint,
+                headers=self.headers,
+                content=json.dumps(payload)
+            )
+            return self.format_response(request_response)
+        except (httpx.HTTPError, KeyError, IndexError, ValueError) as e:
+            return self.format_error(e)
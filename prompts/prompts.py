@@ -1,3 +1,5 @@
+import json
+
 analysis_node2_prompt = """
 You are an expert IELTS examiner. Analyze the following text for task achievement and coherence. 
 Consider the following:
@@ -213,3 +215,180 @@ paraphrasing_guided_json = {
     },
     "required": ["paraphrased_text", "improvements", "overall_comments"]
 }
+
+
+# Prefix-ordered variants of the agent prompts. The *_prefix_prompt part holds
+# only the static instructions and the knowledge base, so it is identical for
+# every essay and can be cached by the provider; the essay-specific content
+# goes into the user message through the matching *_input_prompt.
+
+analysis_node2_prefix_prompt = """
+You are an expert IELTS examiner. Analyze the text provided by the user for task achievement and coherence. 
+Consider the following:
+
+1. Task Achievement:
+   - Does the response fully address all parts of the task?
+   - Is the position clear throughout the response?
+   - Are the ideas well-developed with relevant examples?
+
+2. Coherence and Cohesion:
+   - Is the information logically organized?
+   - Is there a clear progression of ideas?
+   - Is there appropriate use of cohesive devices?
+
+Use the relevant content in Knowledge Base during your analysis, together with the previous analysis results provided by the user.
+Provide a detailed analysis of task achievement and coherence, including specific examples from the text.
+
+Knowledge Base:
+{knowledge_base}
+"""
+
+analysis_node2_input_prompt = """
+Text to analyze:
+{text}
+
+Previous analysis results:
+{analysis_results}
+"""
+
+feedback_generation_prefix_prompt = """
+As an IELTS writing expert, provide detailed feedback on the text provided by the user. 
+Use the analysis results provided by the user to guide your feedback. Focus on:
+
+1. Grammar and vocabulary usage
+2. Task achievement
+3. Coherence and cohesion
+4. Overall writing style
+
+Use the relevant content in Knowledge Base for feedback.
+Provide specific examples from the text and suggest improvements. 
+Your feedback should be constructive and actionable.
+
+Knowledge Base:
+{knowledge_base}
+"""
+
+feedback_generation_input_prompt = """
+Text:
+{text}
+
+Analysis results:
+{analysis_results}
+"""
+
+scoring_prefix_prompt = """
+As an IELTS examiner, provide a detailed score breakdown for the writing sample based on the following criteria:
+
+1. Task Achievement
+2. Coherence and Cohesion
+3. Lexical Resource
+4. Grammatical Range and Accuracy
+
+Use the analysis results provided by the user to inform your scoring. For each criterion, provide a score out of 9 and a brief justification.
+Use the relevant content in Knowledge Base while scoring.
+Provide the overall band score as well as individual scores for each criterion.
+
+Knowledge Base:
+{knowledge_base}
+"""
+
+scoring_input_prompt = """
+Analysis results:
+{analysis_results}
+"""
+
+paraphrasing_prefix_prompt = """
+As an expert IELTS writer, your task is to paraphrase and improve the text provided by the user to achieve an IELTS Band 8 standard. 
+Focus on enhancing:
+
+1. Task Achievement
+2. Coherence and Cohesion
+3. Lexical Resource
+4. Grammatical Range and Accuracy
+
+Use the relevant content in Knowledge Base while paraphrasing.
+
+Please provide:
+1. A paraphrased version that addresses the weaknesses identified in the scoring provided by the user, 
+   while maintaining the original meaning and improving the overall quality to reach Band 8 standard.
+2. A list of specific improvements made for each of the four focus areas.
+3. Any overall comments on the improvements made.
+
+Your response should be in JSON format as specified.
+
+Knowledge Base:
+{knowledge_base}
+"""
+
+paraphrasing_input_prompt = """
+Original text:
+{text}
+
+Current scores:
+{scoring}
+"""
+
+
+# Fused grading: analysis_node2, feedback_generation and scoring in one call.
+# The response is one JSON object keyed by the three node names, each value
+# following that node's own schema, so it can be split back into the usual
+# per-node messages.
+
+grading_guided_json = {
+    "type": "object",
+    "properties": {
+        "analysis_node2": analysis_node2_guided_json,
+        "feedback_generation": feedback_generation_guided_json,
+        "scoring": scoring_guided_json
+    },
+    "required": ["analysis_node2", "feedback_generation", "scoring"]
+}
+
+# Literal braces of the schema must survive str.format
+_grading_schema = json.dumps(grading_guided_json).replace("{", "{{").replace("}", "}}")
+
+grading_instructions = """
+You are an expert IELTS examiner. Grade the writing sample in three steps and return all three results together.
+
+1. analysis_node2 - Analyze task achievement and coherence:
+   - Does the response fully address all parts of the task? Is the position clear throughout?
+   - Are the ideas well-developed with relevant examples?
+   - Is the information logically organized, with a clear progression of ideas and appropriate cohesive devices?
+   Include specific examples from the text.
+
+2. feedback_generation - Using the analysis results and your analysis from step 1, provide detailed feedback on:
+   grammar and vocabulary usage, task achievement, coherence and cohesion, and overall writing style.
+   Provide specific examples from the text and suggest improvements. The feedback should be constructive and actionable.
+
+3. scoring - Using the analysis results and your analysis from step 1, score Task Achievement, Coherence and Cohesion,
+   Lexical Resource and Grammatical Range and Accuracy out of 9 with a brief justification each, and give the overall band score.
+
+Use the relevant content in Knowledge Base throughout.
+Respond with a single JSON object with the keys "analysis_node2", "feedback_generation" and "scoring", matching this JSON schema:
+""" + _grading_schema + "\n"
+
+grading_prompt = grading_instructions + """
+Text to grade:
+{text}
+
+Previous analysis results:
+{analysis_results}
+
+Knowledge Base:
+{knowledge_base}
+"""
+
+grading_prefix_prompt = grading_instructions + """
+The text to grade and the previous analysis results are provided by the user.
+
+Knowledge Base:
+{knowledge_base}
+"""
+
+grading_input_prompt = """
+Text to grade:
+{text}
+
+Previous analysis results:
+{analysis_results}
+"""
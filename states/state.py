@@ -1,9 +1,29 @@
+import operator
 from typing import TypedDict, Annotated
 from langgraph.graph.message import add_messages
 
+class NodeFailure(TypedDict):
+    node: str
+    # provider_error, invalid_output, schema_error or tool_error
+    type: str
+    message: str
+
 class AgentGraphState(TypedDict):
     user_input: str
     messages: Annotated[list, add_messages]
+    # Nodes that failed; once one is recorded the remaining LLM nodes are skipped
+    failures: Annotated[list, operator.add]
+
+def node_failure(node, failure_type, message):
+    return {"failures": [NodeFailure(node=node, type=failure_type, message=message)]}
+
+def no_update():
+    """Update of a node that has nothing to add, e.g. one skipped after a failure.
+
+    LangGraph rejects a node that returns no state key at all, so it writes an
+    empty message list, which add_messages leaves unchanged.
+    """
+    return {"messages": []}
 
 def get_agent_graph_state(state: AgentGraphState, state_key: str):
     if state_key == "user_input":
@@ -25,4 +45,5 @@ def get_agent_graph_state(state: AgentGraphState, state_key: str):
 state = {
     "user_input": "",
     "messages": [],
+    "failures": [],
 }
\ No newline at end of file
@@ -0,0 +1,47 @@
+import asyncio
+import os
+import httpx
+import openai
+import pytest
+import agents.agents as agents_module
+from agents.agents import FlexibleAgent
+from models.openai_models import OpenAIModel
+from models.resilience import retry_settings
+
+
+class RaisingChatModel:
+    """Stands in for ChatOpenAI: every call times out, as the SDK reports it."""
+
+    def invoke(self, messages):
+        request = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+        try:
+            raise httpx.ReadTimeout("timed out", request=request)
+        except httpx.ReadTimeout as e:
+            raise openai.APITimeoutError(request=request) from e
+
+    async def ainvoke(self, messages):
+        return self.invoke(messages)
+
+
+@pytest.fixture
+def agent(monkeypatch, tmp_path):
+    monkeypatch.setitem(retry_settings, "base_delay", 0.0)
+    monkeypatch.setattr(agents_module, "get_client", lambda **kwargs: OpenAIModel(RaisingChatModel()))
+    # handle_response logs to a hardcoded Windows path
+    monkeypatch.setattr(agents_module, "open",
+                        lambda path, *args, **kwargs: open(os.path.join(tmp_path, "response.txt"), *args, **kwargs),
+                        raising=False)
+    state = {"user_input": "An essay.", "messages": [], "failures": []}
+    return FlexibleAgent(state=state, role_name="scoring", server="openai", model="gpt-4o-mini")
+
+
+@pytest.mark.parametrize("use_async", [False, True])
+def test_failed_openai_call_becomes_a_node_failure(agent, use_async):
+    arguments = {"prompt_template": "Grade the essay.", "required_variables": [], "user_content": "Score it."}
+    if use_async:
+        result = asyncio.run(agent.ainvoke(agent.state, **arguments))
+    else:
+        result = agent.invoke(agent.state, **arguments)
+    assert result["failures"][0]["node"] == "scoring"
+    assert result["failures"][0]["type"] == "provider_error"
+    assert "messages" not in result
@@ -0,0 +1,100 @@
+import asyncio
+import json
+import os
+import pytest
+from langchain_core.messages import HumanMessage
+import agent_graph.graph as graph_module
+import tools.format_report as format_report_module
+from agent_graph.checkpointer import get_sqlite_checkpointer, get_run_config, run_workflow
+from agent_graph.graph import create_graph, compile_workflow, plan
+from models.response_cache import ResponseCache
+from states.state import node_failure
+
+
+class FakeAgent:
+    """Stands in for FlexibleAgent: answers "{}" unless its node is in failing."""
+    failing = set()
+
+    def __init__(self, state, role_name, **kwargs):
+        self.role_name = role_name
+
+    def invoke(self, state, **kwargs):
+        if self.role_name in self.failing:
+            return node_failure(self.role_name, "provider_error", "boom")
+        return {"messages": [HumanMessage(role=self.role_name, content="{}")]}
+
+    async def ainvoke(self, state, **kwargs):
+        return self.invoke(state, **kwargs)
+
+
+def tool(role, content="{}"):
+    return lambda state: {"messages": [HumanMessage(role=role, content=content)]}
+
+
+@pytest.fixture
+def workflow(monkeypatch, tmp_path):
+    def build(failing=(), knowledge_base=None, checkpointer=None):
+        FakeAgent.failing = set(failing)
+        monkeypatch.setattr(graph_module, "FlexibleAgent", FakeAgent)
+        # format_report writes report.txt to a hardcoded Windows path
+        monkeypatch.setattr(format_report_module, "open",
+                            lambda path, *args, **kwargs: open(os.path.join(tmp_path, "report.txt"), *args, **kwargs),
+                            raising=False)
+        functions = {
+            "knowledgeBase": knowledge_base or tool("knowledgeBase", "band descriptors"),
+            "preprocessing": tool("preprocessing"),
+            "analysis_node1": tool("analysis_node1"),
+        }
+        for node in plan["nodes"]:
+            if node["name"] in functions:
+                monkeypatch.setitem(node, "function", functions[node["name"]])
+        return compile_workflow(create_graph(server="claude", tool_cache=ResponseCache()), checkpointer)
+    return build
+
+
+def report(state):
+    return next(msg.content for msg in state["messages"] if msg.role == "formatted_report")
+
+
+def run(workflow, use_async):
+    inputs = {"user_input": "An essay.", "messages": [], "failures": []}
+    if use_async:
+        return asyncio.run(workflow.ainvoke(inputs))
+    return workflow.invoke(inputs)
+
+
+@pytest.mark.parametrize("use_async", [False, True])
+def test_failure_in_parallel_sibling_gives_partial_report(workflow, use_async):
+    # scoring runs alongside feedback_generation and still routes to paraphrasing
+    state = run(workflow(failing={"feedback_generation"}), use_async)
+    assert "PARTIAL REPORT" in report(state)
+    assert [failure["node"] for failure in state["failures"]] == ["feedback_generation"]
+    assert not any(msg.role == "paraphrasing" for msg in state["messages"])
+
+
+@pytest.mark.parametrize("use_async", [False, True])
+def test_failed_tool_skips_the_agents_waiting_on_it(workflow, use_async):
+    failed_loader = lambda state: node_failure("knowledgeBase", "tool_error", "file not found")
+    state = run(workflow(knowledge_base=failed_loader), use_async)
+    assert "Failed step: knowledgeBase" in report(state)
+    assert not any(msg.role == "analysis_node2" for msg in state["messages"])
+
+
+def test_rerun_with_a_report_keeps_it(workflow):
+    app = workflow()
+    state = run(app, use_async=False)
+    first = report(state)
+    state = app.invoke(state)
+    assert [msg.content for msg in state["messages"] if msg.role == "formatted_report"] == [first]
+
+
+def test_resume_from_checkpoint_keeps_message_roles(workflow, tmp_path):
+    checkpointer = get_sqlite_checkpointer(os.path.join(tmp_path, "checkpoints.sqlite"))
+    config = get_run_config("essay-1")
+    inputs = {"user_input": "An essay.", "messages": [], "failures": []}
+    state = run_workflow(workflow(failing={"scoring"}, checkpointer=checkpointer), inputs, config)
+    assert "PARTIAL REPORT" in report(state)
+    # The retry reads the earlier nodes' messages back from the checkpoint by role
+    state = run_workflow(workflow(checkpointer=checkpointer), inputs, config)
+    assert "PARTIAL REPORT" not in report(state)
+    assert any(msg.role == "knowledgeBase" for msg in state["messages"])
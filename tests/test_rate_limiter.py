@@ -0,0 +1,13 @@
+from models.rate_limiter import ProviderLimiter
+
+
+def test_burst_of_429s_halves_the_limit_once():
+    limiter = ProviderLimiter("groq", concurrency=8)
+    in_flight = [limiter.acquire() for _ in range(8)]
+    # All eight were sent before the provider pushed back
+    for started in in_flight:
+        limiter.release("throttled", started=started)
+    assert int(limiter.limit) == 4
+    # A call admitted after the decrease is a new congestion event
+    limiter.release("throttled", started=limiter.acquire())
+    assert int(limiter.limit) == 2
@@ -1,45 +1,47 @@
-import textstat
-from wordfreq import word_frequency
-from difflib import SequenceMatcher
 from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
 import numpy as np
 from langchain_core.messages import HumanMessage
 import json
-import spacy
-
-# Load spaCy model (make sure it's loaded only once in your application)
-nlp = spacy.load("en_core_web_sm")
-
-def improved_grammar_check(text):
+from tools.linguistics import get_linguistic_layer, parse_essays, sentence_spans, text_tokens, text_sentences
+from tools.word_frequency import word_frequencies, zipf_values, zipf_bands, ZIPF_BANDS, RARE_ZIPF
+from tools.sentence_similarity import sentence_similarity_matrix, gram_matrix, SIMILARITY_METRIC
+from tools.nlp_resources import NLP_RESOURCES_VERSION
+
+# Bump whenever the output of analysis_node1_tool changes, so memoized results are recomputed.
+# It includes the sentence similarity metric and the spaCy model, syllable and
+# word frequency data versions, which change the output too.
+ANALYSIS_NODE1_TOOL_VERSION = f"6-{SIMILARITY_METRIC}-{NLP_RESOURCES_VERSION}"
+
+def improved_grammar_check(layer):
+    """Rule-based grammar checks over the linguistic layer built by preprocessing."""
     errors = []
-    doc = nlp(text)
+    tokens, pos, tag, dep, head = layer["tokens"], layer["pos"], layer["tag"], layer["dep"], layer["head"]
 
-    for sent in doc.sents:
+    for (start, end), sentence in zip(sentence_spans(layer), layer["sentences"]):
         # Check for subject-verb agreement
         subject = None
         verb = None
-        for token in sent:
-            if token.dep_ == "nsubj":
-                subject = token
-            if token.pos_ == "VERB":
-                verb = token
-            if subject and verb:
-                if subject.tag_ == "NNS" and verb.tag_ == "VBZ":
-                    errors.append(f"Subject-verb disagreement: '{subject}' (plural) with '{verb}' (singular)")
-                elif subject.tag_ == "NN" and verb.tag_ == "VBP":
-                    errors.append(f"Subject-verb disagreement: '{subject}' (singular) with '{verb}' (plural)")
+        for i in range(start, end):
+            if dep[i] == "nsubj":
+                subject = i
+            if pos[i] == "VERB":
+                verb = i
+            if subject is not None and verb is not None:
+                if tag[subject] == "NNS" and tag[verb] == "VBZ":
+                    errors.append(f"Subject-verb disagreement: '{tokens[subject]}' (plural) with '{tokens[verb]}' (singular)")
+                elif tag[subject] == "NN" and tag[verb] == "VBP":
+                    errors.append(f"Subject-verb disagreement: '{tokens[subject]}' (singular) with '{tokens[verb]}' (plural)")
                 break
 
         # Check for incorrect verb forms
-        for token in sent:
-            if token.text == "consist" and token.pos_ == "VERB":
+        for i in range(start, end):
+            if tokens[i] == "consist" and pos[i] == "VERB":
                 errors.append(f"Incorrect verb form: 'consist' should be 'consists'")
-            if token.text == "have" and token.pos_ == "VERB" and token.head.pos_ != "VERB":
+            if tokens[i] == "have" and pos[i] == "VERB" and pos[head[i]] != "VERB":
                 errors.append(f"Incorrect verb form: 'have' should be 'has'")
 
         # Check for common mistakes
-        text = sent.text.lower()
+        text = sentence.lower()
         if "there " in text and "shape" in text:
             errors.append("Incorrect use of 'there'. Did you mean 'their'?")
         if "then" in text and "than" not in text:
@@ -49,59 +51,194 @@ def improved_grammar_check(text):
 
     return errors
 
+def summarize_similarities(similarity_matrix, top_k=5, cluster_threshold=0.6, bins=10):
+    """Bounded-size summary of the pairwise sentence similarity matrix.
+
+    Returns a histogram of the pair similarities, the top_k most similar pairs
+    (by sentence index) and the groups of sentences linked by pairs at or above
+    cluster_threshold, so the prompt size does not grow with the essay length.
+    """
+    n = len(similarity_matrix)
+    rows, cols = np.triu_indices(n, k=1)
+    pair_scores = similarity_matrix[rows, cols]
+
+    counts, edges = np.histogram(pair_scores, bins=bins, range=(0.0, 1.0))
+    histogram = [
+        {"range": [round(float(edges[b]), 2), round(float(edges[b + 1]), 2)], "pairs": int(counts[b])}
+        for b in range(bins)
+    ]
+
+    top = np.argsort(-pair_scores, kind="stable")[:top_k]
+    most_similar_pairs = [
+        {"sentences": [int(rows[p]), int(cols[p])], "similarity": round(float(pair_scores[p]), 3)}
+        for p in top
+    ]
+
+    # Union-find over the strongly similar pairs gives the repetition clusters
+    parent = list(range(n))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for p in np.flatnonzero(pair_scores >= cluster_threshold):
+        parent[find(int(rows[p]))] = find(int(cols[p]))
+
+    clusters = {}
+    for i in range(n):
+        clusters.setdefault(find(i), []).append(i)
+    repetition_clusters = sorted(
+        (members for members in clusters.values() if len(members) > 1), key=len, reverse=True
+    )[:top_k]
+
+    return {
+        "sentence_count": n,
+        "pair_count": int(len(pair_scores)),
+        "histogram": histogram,
+        "most_similar_pairs": most_similar_pairs,
+        "repetition_threshold": cluster_threshold,
+        # Large clusters list only their first sentences, keeping the size bounded
+        "repetition_clusters": [
+            {"size": len(members), "sentences": members[:10]} for members in repetition_clusters
+        ]
+    }
+
+def readability_scores(layers):
+    """Flesch reading ease of every essay from its word, sentence and syllable counts."""
+    words = np.array([sum(layer["is_word"]) for layer in layers], dtype=float)
+    sentences = np.array([len(text_sentences(layer)) for layer in layers], dtype=float)
+    syllables = np.array([sum(layer["syllables"]) for layer in layers], dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        scores = 206.835 - 1.015 * (words / sentences) - 84.6 * (syllables / words)
+    return np.round(np.where((words > 0) & (sentences > 0), scores, 0.0), 2)
+
+def lexical_features(layers):
+    """Vocabulary features of every essay from one table lookup of all their tokens.
+
+    vocab_complexity is the mean word frequency over all tokens but whitespace. The
+    Zipf features cover the words only: the mean Zipf value and the share of
+    words in each Zipf band among those wordfreq knows, the share of rare words
+    (Zipf below RARE_ZIPF) and the share of unknown words, e.g. misspellings.
+    """
+    # Whitespace tokens are left out, so paragraph breaks do not change the mean
+    kept = [text_tokens(layer) for layer in layers]
+    counts = np.array([len(indexes) for indexes in kept])
+    owners = np.repeat(np.arange(len(layers)), counts)
+    frequencies = word_frequencies([layer["tokens"][i] for layer, indexes in zip(layers, kept) for i in indexes])
+    is_word = np.array([layer["is_word"][i] for layer, indexes in zip(layers, kept) for i in indexes], dtype=bool)
+
+    word_owners = owners[is_word]
+    zipf = zipf_values(frequencies[is_word])
+    known = zipf > 0
+    words = np.bincount(word_owners, minlength=len(layers))
+    known_words = np.bincount(word_owners[known], minlength=len(layers))
+    bands = np.zeros((len(layers), len(ZIPF_BANDS)))
+    np.add.at(bands, (word_owners[known], zipf_bands(zipf[known])), 1)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return {
+            # NaN for an essay without tokens, like np.mean of an empty list
+            "vocab_complexity": np.bincount(owners, weights=frequencies, minlength=len(layers)) / counts,
+            "mean_zipf": np.nan_to_num(np.bincount(word_owners[known], weights=zipf[known], minlength=len(layers)) / known_words),
+            "zipf_bands": np.nan_to_num(bands / known_words[:, None]),
+            "rare_word_ratio": np.nan_to_num(np.bincount(word_owners, weights=known & (zipf < RARE_ZIPF), minlength=len(layers)) / words),
+            "unknown_word_ratio": np.nan_to_num(np.bincount(word_owners, weights=~known, minlength=len(layers)) / words),
+        }
+
+def sentence_similarities(sentences, metric=SIMILARITY_METRIC):
+    """Pairwise similarity matrix of an essay's sentences and its mean TF-IDF cosine similarity."""
+    try:
+        tfidf_vectorizer = TfidfVectorizer()
+        tfidf_matrix = tfidf_vectorizer.fit_transform(sentences)
+        # Rows are L2-normalised, so their dot products are the cosine similarities
+        tfidf_gram = gram_matrix(tfidf_matrix)
+        tfidf_similarity = float(np.mean(tfidf_gram))
+    except ValueError:
+        # No terms at all, e.g. an empty or punctuation-only essay
+        tfidf_gram = np.zeros((len(sentences), len(sentences)))
+        tfidf_similarity = 0.0
+
+    similarity_matrix = sentence_similarity_matrix(sentences, metric, tfidf_gram=tfidf_gram)
+    return similarity_matrix, tfidf_similarity
+
+def analyze_layers(layers, metric=SIMILARITY_METRIC):
+    """analysis_node1 features of many essays, as columns with one entry per essay.
+
+    Counts and scores are NumPy arrays computed for all essays at once, and
+    zipf_bands has one row per essay and one column per band of ZIPF_BANDS; the
+    grammar errors, similarity summaries and matrices are lists.
+    """
+    columns = {
+        "word_count": np.array([sum(layer["is_word"]) for layer in layers], dtype=int),
+        "sentence_count": np.array([len(text_sentences(layer)) for layer in layers], dtype=int),
+        "grammar_errors": [improved_grammar_check(layer) for layer in layers],
+        "readability_score": readability_scores(layers),
+        "sentence_similarity_summary": [],
+        "similarity_matrix": [],
+    }
+    columns.update(lexical_features(layers))
+    average_similarity = np.zeros(len(layers))
+    tfidf_similarity = np.zeros(len(layers))
+    for index, layer in enumerate(layers):
+        similarity_matrix, tfidf_similarity[index] = sentence_similarities(text_sentences(layer), metric)
+        pair_scores = similarity_matrix[np.triu_indices(len(similarity_matrix), k=1)]
+        average_similarity[index] = np.mean(pair_scores) if len(pair_scores) else 0.0
+        columns["sentence_similarity_summary"].append(summarize_similarities(similarity_matrix))
+        columns["similarity_matrix"].append(similarity_matrix)
+    columns["grammar_error_count"] = np.array([len(errors) for errors in columns["grammar_errors"]], dtype=int)
+    columns["average_sentence_similarity"] = average_similarity
+    columns["tfidf_similarity"] = tfidf_similarity
+    return columns
+
+def analyze_essays(texts, batch_size=32, n_process=1, metric=SIMILARITY_METRIC):
+    """Batch API of analysis_node1: parse the essays with nlp.pipe and return the feature columns.
+
+    n_process > 1 parses in that many worker processes, so a large feature
+    extraction pass scales with the cores.
+    """
+    return analyze_layers(parse_essays(texts, batch_size=batch_size, n_process=n_process), metric)
+
 def analysis_node1_tool(state):
     # Extract preprocessed data from the messages
     preprocessed_data_message = next((msg for msg in state["messages"] if msg.role == "preprocessing"), None)
     if not preprocessed_data_message:
         raise ValueError("Preprocessed data not found in state")
 
-    preprocessed_data = json.loads(preprocessed_data_message.content)
-
-    text = preprocessed_data["text"]
-    words = preprocessed_data["words"]
-    sentences = preprocessed_data["sentences"]
-
-    # Improved grammar checking
-    grammar_errors = improved_grammar_check(text)
-
-    # Readability analysis
-    readability_score = textstat.flesch_reading_ease(text)
-
-    # Vocabulary assessment
-    vocab_complexity = np.mean([word_frequency(word, 'en') for word in words])
-
-    # Sentence similarity
-    similarity_scores = []
-    for i in range(len(sentences)):
-        for j in range(i+1, len(sentences)):
-            similarity = SequenceMatcher(None, sentences[i], sentences[j]).ratio()
-            similarity_scores.append(similarity)
-
-    # TF-IDF similarity
-    tfidf_vectorizer = TfidfVectorizer()
-    tfidf_matrix = tfidf_vectorizer.fit_transform(sentences)
-    tfidf_similarity = np.mean(cosine_similarity(tfidf_matrix))
+    # Tokens, sentences, parse and syllables from the single pass in preprocessing;
+    # one essay is a batch of one
+    features = analyze_layers([get_linguistic_layer(state)])
+    similarity_matrix = features["similarity_matrix"][0]
 
     analysis_results = {
-        "grammar_errors": grammar_errors,
-        "readability_score": readability_score,
-        "vocab_complexity": vocab_complexity,
-        "sentence_similarities": similarity_scores,
-        "average_sentence_similarity": np.mean(similarity_scores),
-        "tfidf_similarity": tfidf_similarity
+        "grammar_errors": features["grammar_errors"][0],
+        "readability_score": float(features["readability_score"][0]),
+        "vocab_complexity": float(features["vocab_complexity"][0]),
+        "lexical_profile": {
+            "mean_zipf": round(float(features["mean_zipf"][0]), 2),
+            "rare_word_ratio": round(float(features["rare_word_ratio"][0]), 3),
+            "unknown_word_ratio": round(float(features["unknown_word_ratio"][0]), 3),
+            "zipf_bands": {name: round(float(share), 3) for (name, _), share in zip(ZIPF_BANDS, features["zipf_bands"][0])}
+        },
+        "sentence_similarity_summary": features["sentence_similarity_summary"][0],
+        "average_sentence_similarity": float(features["average_sentence_similarity"][0]),
+        "tfidf_similarity": float(features["tfidf_similarity"][0])
     }
 
     # # Store analysis_results into a file (if needed)
     # with open("analysis_node1_results.json", 'w') as file:
     #     json.dump(analysis_results, file, indent=4)
 
-    # Update state with the correct message structure
-    state["messages"].append(
-        HumanMessage(role="analysis_node1", content=json.dumps(analysis_results))
+    analysis_message = HumanMessage(role="analysis_node1", content=json.dumps(analysis_results))
+    # The full matrix stays out of the prompts; no agent node lists this role in its variables
+    similarity_matrix_message = HumanMessage(
+        role="analysis_node1_similarity_matrix",
+        content=json.dumps(np.round(similarity_matrix, 4).tolist())
     )
-            # Log the action
+    # Log the action
     with open("D:/VentureInternship/AI Agent/ProjectK/response.txt", "a") as log_file:
         log_file.write(f"\nAnalysis Node 1: {json.dumps(analysis_results)}\n")
 
 
-    return {"messages": state["messages"]}
\ No newline at end of file
+    return {"messages": [analysis_message, similarity_matrix_message]}
\ No newline at end of file
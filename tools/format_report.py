@@ -2,8 +2,23 @@ import json
 import re
 from datetime import datetime
 from langchain_core.messages import HumanMessage
+from states.state import node_failure, no_update
+
+# Sections of the report, by the node that produces them
+REPORT_SECTIONS = {
+    "analysis_node1": "Analysis Node 1",
+    "analysis_node2": "Analysis Node 2",
+    "feedback_generation": "Feedback",
+    "scoring": "Scores",
+    "paraphrasing": "Paraphrased Content",
+}
 
 def format_report(state):
+    # A failure routes here early; the branches still running may reach this
+    # node again afterwards, and the first report is kept
+    if any(msg.role == "formatted_report" for msg in state["messages"]):
+        return no_update()
+
     try:
         # Extract all relevant messages from the state
         analysis_node1 = next((msg for msg in state["messages"] if msg.role == "analysis_node1"), None)
@@ -17,6 +32,19 @@ def format_report(state):
         formatted_report += "=" * 40 + "\n"
         formatted_report += f"Generated on: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n\n"
 
+        # A run stopped by a failed node gets a partial report of what did complete
+        failures = state.get("failures") or []
+        if failures:
+            completed = {msg.role for msg in state["messages"]}
+            formatted_report += "PARTIAL REPORT - grading stopped after a failure\n"
+            formatted_report += "-" * 40 + "\n"
+            for failure in failures:
+                formatted_report += f"Failed step: {failure['node']} ({failure['type']}): {failure['message']}\n"
+            missing = [title for role, title in REPORT_SECTIONS.items() if role not in completed]
+            if missing:
+                formatted_report += f"Missing sections: {', '.join(missing)}\n"
+            formatted_report += "\n"
+
         # Add Analysis Results
         formatted_report += "Analysis Results:\n"
         formatted_report += "-" * 40 + "\n"
@@ -54,13 +82,9 @@ def format_report(state):
         print("Report generated successfully and saved to report.txt")
 
         # Add the formatted report to the state
-        state["messages"].append(
-            HumanMessage(role="formatted_report", content=formatted_report)
-        )
-
-        return {"messages": state["messages"]}
+        return {"messages": [HumanMessage(role="formatted_report", content=formatted_report)]}
 
     except Exception as e:
         error_message = f"Error generating report: {str(e)}"
         print(error_message)
-        return {"error": error_message}
\ No newline at end of file
+        return node_failure("report_generation", "tool_error", error_message)
\ No newline at end of file
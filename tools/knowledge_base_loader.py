@@ -1,4 +1,5 @@
 from langchain_core.messages import HumanMessage
+from states.state import node_failure
 import json
 
 def knowledge_base_loader(state):
@@ -13,14 +14,11 @@ def knowledge_base_loader(state):
             content=json.dumps({"knowledge_base": knowledge_base_content})
         )
 
-        # Add the message to the state
-        state["messages"].append(knowledge_base_message)
-
         # Log the action
-        with open("D:/VentureInternship/AI Agent/ProjectK/response.txt", "w") as log_file:
+        with open("D:/VentureInternship/AI Agent/ProjectK/response.txt", "a") as log_file:
             log_file.write(f"\nKnowledge Base Loader: Loaded knowledge base\n")
 
-        return {"messages": state["messages"]}
+        return {"messages": [knowledge_base_message]}
 
     except Exception as e:
         error_message = f"Error loading knowledge base: {str(e)}"
@@ -30,5 +28,5 @@ def knowledge_base_loader(state):
         # with open("response.txt", "a") as log_file:
         #     log_file.write(f"\nKnowledge Base Loader Error: {error_message}\n")
 
-        # Return an error state
-        return {"error": error_message}
\ No newline at end of file
+        # Record the failure; the LLM nodes that need the knowledge base are skipped
+        return node_failure("knowledgeBase", "tool_error", error_message)
\ No newline at end of file
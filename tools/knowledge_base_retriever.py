@@ -0,0 +1,73 @@
+import hashlib
+import threading
+import numpy as np
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+
+def chunk_text(text, max_chars=800):
+    """Split the knowledge base into paragraph-aligned chunks of at most ~max_chars."""
+    chunks = []
+    current = ""
+    for paragraph in (p.strip() for p in text.split("\n\n")):
+        if not paragraph:
+            continue
+
+        # Paragraphs longer than a chunk are cut at the last whitespace that fits
+        while len(paragraph) > max_chars:
+            cut = paragraph.rfind(" ", 0, max_chars)
+            cut = cut if cut > 0 else max_chars
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.append(paragraph[:cut].strip())
+            paragraph = paragraph[cut:].strip()
+
+        if current and len(current) + len(paragraph) + 2 > max_chars:
+            chunks.append(current)
+            current = paragraph
+        else:
+            current = f"{current}\n\n{paragraph}" if current else paragraph
+
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+class KnowledgeBaseIndex:
+    """TF-IDF index over the knowledge base chunks."""
+
+    def __init__(self, text, max_chars=800):
+        self.chunks = chunk_text(text, max_chars)
+        self.vectorizer = TfidfVectorizer(stop_words="english", sublinear_tf=True)
+        self.matrix = self.vectorizer.fit_transform(self.chunks) if self.chunks else None
+
+    def search(self, query, k):
+        """Return the k chunks most relevant to the query, in knowledge base order."""
+        if self.matrix is None or k >= len(self.chunks):
+            return list(self.chunks)
+
+        query_vector = self.vectorizer.transform([query])
+        # Rows are L2-normalised, so the dot product is the cosine similarity
+        scores = (self.matrix @ query_vector.T).toarray().ravel()
+        top = np.argsort(-scores, kind="stable")[:k]
+        return [self.chunks[i] for i in sorted(top)]
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_knowledge_base_index(text):
+    """Build the index for this knowledge base once per process."""
+    key = hashlib.sha256(text.encode('utf-8')).hexdigest()
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is None:
+            index = KnowledgeBaseIndex(text)
+            _indexes[key] = index
+    return index
+
+
+def retrieve_knowledge_base(text, query, k):
+    """Top-k knowledge base passages for the query, joined back into prompt text."""
+    return "\n\n".join(get_knowledge_base_index(text).search(query, k))
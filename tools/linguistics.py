@@ -0,0 +1,79 @@
+import json
+from functools import lru_cache
+from tools.nlp_resources import get_nlp, get_hyphenator, get_syllable_dictionary
+
+# Role of the message carrying the linguistic layer of the essay. Like the
+# similarity matrix of analysis_node1 it stays out of the prompts: no agent
+# node lists it in its variables.
+LINGUISTICS_ROLE = "preprocessing_linguistics"
+
+
+def linguistic_layer(doc):
+    """Token-level annotations of a parsed essay, one list per attribute.
+
+    Produced once by preprocessing and read by every downstream feature, so
+    the essay is tokenized, split into sentences and parsed a single time and
+    all tools agree on the sentence boundaries. Token i of a sentence s lies
+    in range(sentence_starts[s], sentence_starts[s + 1]). The columns keep
+    spaCy's whitespace tokens (e.g. paragraph breaks) so the indexes line up;
+    text_tokens and text_sentences leave them out.
+    """
+    return {
+        "tokens": [token.text for token in doc],
+        "pos": [token.pos_ for token in doc],
+        "tag": [token.tag_ for token in doc],
+        "dep": [token.dep_ for token in doc],
+        # Index of each token's syntactic head within the essay
+        "head": [token.head.i for token in doc],
+        "is_word": [not (token.is_punct or token.is_space) for token in doc],
+        "syllables": [0 if token.is_punct or token.is_space else syllable_count(token.lower_) for token in doc],
+        "sentence_starts": [sent.start for sent in doc.sents],
+        "sentences": [sent.text for sent in doc.sents],
+    }
+
+
+@lru_cache(maxsize=65536)
+def syllable_count(word):
+    """Syllables of a lowercase word: from the CMU dictionary, else hyphenation points plus one."""
+    count = get_syllable_dictionary().get(word)
+    if count is None:
+        count = len(get_hyphenator().positions(word)) + 1
+    return count
+
+
+def text_tokens(layer):
+    """Indexes of the tokens that are not whitespace, the tokens NLTK's word_tokenize used to give."""
+    return [i for i, token in enumerate(layer["tokens"]) if not token.isspace()]
+
+
+def text_sentences(layer):
+    """The sentences that are not only whitespace, e.g. a trailing line break."""
+    return [sentence for sentence in layer["sentences"] if not sentence.isspace()]
+
+
+def parse_essay(text):
+    """Parse an essay once; returns the spaCy Doc and its linguistic layer."""
+    doc = get_nlp()(text)
+    return doc, linguistic_layer(doc)
+
+
+def parse_essays(texts, batch_size=32, n_process=1):
+    """Linguistic layers of many essays, parsed in batches with nlp.pipe."""
+    docs = get_nlp().pipe(texts, batch_size=batch_size, n_process=n_process)
+    return [linguistic_layer(doc) for doc in docs]
+
+
+def get_linguistic_layer(state):
+    """The layer preprocessing stored in the state, or a fresh parse when it is missing."""
+    message = next((msg for msg in state["messages"] if msg.role == LINGUISTICS_ROLE), None)
+    if message is not None:
+        return json.loads(message.content)
+    # e.g. a checkpoint written before preprocessing emitted the layer
+    return parse_essay(state["user_input"])[1]
+
+
+def sentence_spans(layer):
+    """(start, end) token indexes of every sentence."""
+    starts = layer["sentence_starts"]
+    ends = starts[1:] + [len(layer["tokens"])]
+    return list(zip(starts, ends))
@@ -0,0 +1,62 @@
+import json
+import hashlib
+import threading
+from langchain_core.messages import HumanMessage
+from models.response_cache import ResponseCache
+
+# Default in-process store for memoized tool nodes; pass a ResponseCache with a
+# db_path to create_graph to share results across processes instead.
+default_tool_cache = ResponseCache(max_memory_entries=128)
+
+_inflight = {}
+_inflight_lock = threading.Lock()
+
+
+def tool_cache_key(name, version, state, required_variables):
+    # required_variables must name every message role the tool reads, or a
+    # changed input would be served a stale result
+    inputs = {"user_input": state.get("user_input")}
+    for var in required_variables:
+        inputs[var] = next((msg.content for msg in state["messages"] if msg.role == var), None)
+    raw = json.dumps([name, version, inputs], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+def memoize_tool(function, name, version, required_variables, cache=None):
+    """Wrap a pure tool node so identical inputs reuse its earlier output.
+
+    The key covers the tool name, its version and the node's inputs, so bumping
+    the version invalidates old results. Concurrent calls with the same key
+    wait for the first one instead of repeating the work.
+    """
+    cache = cache if cache is not None else default_tool_cache
+
+    def restore(cached):
+        return {"messages": [HumanMessage(role=role, content=content) for role, content in json.loads(cached)]}
+
+    def memoized(state):
+        key = tool_cache_key(name, version, state, required_variables)
+        cached = cache.get(key)
+        if cached is not None:
+            return restore(cached)
+
+        with _inflight_lock:
+            key_lock = _inflight.setdefault(key, threading.Lock())
+
+        try:
+            with key_lock:
+                cached = cache.get(key)
+                if cached is not None:
+                    return restore(cached)
+
+                result = function(state)
+                # Failed tools return an error dict without messages; don't keep those
+                if "messages" in result:
+                    cache.put(key, json.dumps([(msg.role, msg.content) for msg in result["messages"]]))
+                return result
+        finally:
+            with _inflight_lock:
+                _inflight.pop(key, None)
+
+    memoized.__name__ = getattr(function, "__name__", name)
+    return memoized
@@ -0,0 +1,94 @@
+import os
+import json
+import threading
+from importlib.metadata import version, PackageNotFoundError
+
+# spaCy pipeline used by the analysis tools. Only the components the tools read
+# are loaded: the tagger (token.pos_/tag_), parser (token.dep_, doc.sents) and
+# ner (doc.ents); the lemmatizer is never used, so it is excluded.
+SPACY_MODEL = os.environ.get("SPACY_MODEL", "en_core_web_sm")
+SPACY_EXCLUDE = ["lemmatizer"]
+
+# Syllables are counted like textstat does: from the CMU Pronouncing Dictionary,
+# falling back to the hyphenation points of words it does not list. Both are
+# bundled with their packages (cmudict, pyphen), so nothing is downloaded,
+# unlike textstat's lookup which fetches the dictionary as NLTK data.
+HYPHENATION_LANG = "en_US"
+
+
+def package_version(name):
+    """Installed version of a package, or of a spaCy model given as a directory, without importing it."""
+    try:
+        return version(name)
+    except PackageNotFoundError:
+        meta_path = os.path.join(name, "meta.json")
+        if os.path.isfile(meta_path):
+            with open(meta_path, encoding="utf-8") as file:
+                meta = json.load(file)
+            return f"{meta.get('name')}-{meta.get('version')}"
+        return "missing"
+
+
+# Versions of the model and data the tools' output depends on. The tool
+# versions include it, so memoized results are recomputed after installing
+# another spaCy model, or a new release of the dictionaries or frequency list.
+NLP_RESOURCES_VERSION = ",".join(
+    f"{name}={package_version(name)}"
+    for name in (SPACY_MODEL, "spacy", "cmudict", "pyphen", "wordfreq")
+)
+
+_nlp = None
+_hyphenator = None
+_syllable_dictionary = None
+_lock = threading.Lock()
+
+
+def get_nlp():
+    """The process-wide spaCy pipeline, loaded on first use and shared by every tool and thread."""
+    global _nlp
+    if _nlp is None:
+        with _lock:
+            if _nlp is None:
+                import spacy
+                try:
+                    _nlp = spacy.load(SPACY_MODEL, exclude=SPACY_EXCLUDE)
+                except OSError as e:
+                    raise OSError(
+                        f"spaCy model '{SPACY_MODEL}' is not installed. Install it when building the "
+                        f"environment: python -m spacy download {SPACY_MODEL}"
+                    ) from e
+    return _nlp
+
+
+def get_hyphenator():
+    global _hyphenator
+    if _hyphenator is None:
+        with _lock:
+            if _hyphenator is None:
+                import pyphen
+                _hyphenator = pyphen.Pyphen(lang=HYPHENATION_LANG)
+    return _hyphenator
+
+
+def get_syllable_dictionary():
+    """Syllable count of every word of the CMU Pronouncing Dictionary, from its first pronunciation."""
+    global _syllable_dictionary
+    if _syllable_dictionary is None:
+        with _lock:
+            if _syllable_dictionary is None:
+                import cmudict
+                # Each vowel phoneme carries a stress digit, e.g. AH0
+                _syllable_dictionary = {
+                    word: sum(phone[-1].isdigit() for phone in pronunciations[0])
+                    for word, pronunciations in cmudict.dict().items()
+                }
+    return _syllable_dictionary
+
+
+def warm_up():
+    """Load the resources up front, so the first essay does not pay for it and a missing model fails fast."""
+    from tools.word_frequency import get_frequency_table
+    get_nlp()
+    get_hyphenator()
+    get_syllable_dictionary()
+    get_frequency_table()
@@ -1,29 +1,27 @@
-import spacy
-import nltk
-from nltk.tokenize import word_tokenize, sent_tokenize
 from langchain_core.messages import HumanMessage
 import json
+from tools.linguistics import parse_essay, text_tokens, text_sentences, LINGUISTICS_ROLE
+from tools.nlp_resources import NLP_RESOURCES_VERSION
 
-# Download necessary NLTK data
-nltk.download('punkt')
-nltk.download('averaged_perceptron_tagger')
-nltk.download('wordnet')
-
-# Load spaCy model
-nlp = spacy.load("en_core_web_sm")
+# Bump whenever the output of preprocessing_tool changes, so memoized results are recomputed.
+# It includes the spaCy model and syllable data versions, which change the output too.
+PREPROCESSING_TOOL_VERSION = f"3-{NLP_RESOURCES_VERSION}"
 
 def preprocessing_tool(state):
     user_input = state["user_input"]
 
-    # Tokenization
-    words = word_tokenize(user_input)
-    sentences = sent_tokenize(user_input)
+    # Single spaCy pass: tokens, sentences, tags, dependencies and syllables
+    # are computed here once and reused by analysis_node1
+    doc, linguistics = parse_essay(user_input)
 
-    # SpaCy processing
-    doc = nlp(user_input)
+    # Tokenization, without spaCy's whitespace tokens and sentences such as
+    # paragraph breaks; the similarity summary indexes these sentences
+    kept = text_tokens(linguistics)
+    words = [linguistics["tokens"][i] for i in kept]
+    sentences = text_sentences(linguistics)
 
     # POS tagging
-    pos_tags = [(token.text, token.pos_) for token in doc]
+    pos_tags = [(linguistics["tokens"][i], linguistics["pos"][i]) for i in kept]
 
     # Named Entity Recognition
     named_entities = [(ent.text, ent.label_) for ent in doc.ents]
@@ -40,13 +38,11 @@ def preprocessing_tool(state):
     # with open("preprocessed_data.json", 'w') as file:
     #     json.dump(preprocessed_data, file, indent=4)
 
-    # Update state with the correct message structure
-    state["messages"].append(
-        HumanMessage(role="preprocessing", content=json.dumps(preprocessed_data))
-    )
+    preprocessing_message = HumanMessage(role="preprocessing", content=json.dumps(preprocessed_data))
+    linguistics_message = HumanMessage(role=LINGUISTICS_ROLE, content=json.dumps(linguistics))
         # Log the action
     with open("D:/VentureInternship/AI Agent/ProjectK/response.txt", "a") as log_file:
         log_file.write(f"\nPreprocessing Node{json.dumps(preprocessed_data)}\n")
     
 
-    return {"messages": state["messages"]}
\ No newline at end of file
+    return {"messages": [preprocessing_message, linguistics_message]}
\ No newline at end of file
@@ -0,0 +1,106 @@
+import os
+from difflib import SequenceMatcher
+import numpy as np
+from scipy.sparse import csr_matrix, issparse
+
+# How sentence pairs are compared:
+#   char_dice         Dice coefficient of the sentences' character n-gram sets (default);
+#                     like SequenceMatcher.ratio() it is 2 * shared / total
+#   char_cosine       cosine similarity of the same n-gram sets
+#   tfidf             cosine similarity of the word TF-IDF vectors
+#   sequence_matcher  the exact pairwise difflib ratio, quadratic in the sentence
+#                     count and length; kept to validate the others against
+SIMILARITY_METRICS = ("char_dice", "char_cosine", "tfidf", "sequence_matcher")
+SIMILARITY_METRIC = os.environ.get("SENTENCE_SIMILARITY_METRIC", "char_dice")
+NGRAM_SIZE = 3
+UNICODE_SIZE = 0x110000
+
+# Matrices up to this many cells are multiplied densely, which beats the sparse
+# product for the few hundred sentences of an essay
+DENSE_PRODUCT_CELLS = 4_000_000
+
+
+def char_ngram_matrix(sentences, n=NGRAM_SIZE):
+    """Binary sparse matrix with one row per sentence and one column per character n-gram.
+
+    The n-grams are extracted with NumPy: every n-gram of the lowercased,
+    space-padded sentences is packed into one integer of its code points
+    (three fit in 64 bits), and np.unique numbers the distinct ones.
+    """
+    if n > 3:
+        raise ValueError("Character n-grams longer than 3 do not fit in 64-bit codes")
+    padded = [f" {sentence.lower()} " for sentence in sentences]
+    lengths = np.array([len(text) for text in padded])
+    codes = np.frombuffer("".join(padded).encode("utf-32-le"), dtype=np.uint32).astype(np.int64)
+
+    grams = codes[:max(len(codes) - n + 1, 0)]
+    for k in range(1, n):
+        grams = grams * UNICODE_SIZE + codes[k:len(codes) - n + 1 + k]
+
+    # Drop the n-grams running from one sentence into the next
+    rows = np.repeat(np.arange(len(sentences)), lengths)[:len(grams)]
+    starts = np.cumsum(lengths) - lengths
+    within = np.arange(len(grams)) - starts[rows] <= lengths[rows] - n
+    rows, grams = rows[within], grams[within]
+
+    _, columns = np.unique(grams, return_inverse=True)
+    matrix = csr_matrix(
+        (np.ones(len(rows)), (rows, columns)),
+        shape=(len(sentences), int(columns.max()) + 1 if len(columns) else 0)
+    )
+    # Repeated n-grams of a sentence count once
+    matrix.sum_duplicates()
+    matrix.data[:] = 1.0
+    return matrix
+
+
+def gram_matrix(matrix):
+    """matrix @ matrix.T as a dense array: pairwise dot products of the rows."""
+    if issparse(matrix) and matrix.shape[0] * matrix.shape[1] > DENSE_PRODUCT_CELLS:
+        return (matrix @ matrix.T).toarray()
+    dense = matrix.toarray() if issparse(matrix) else np.asarray(matrix)
+    return dense @ dense.T
+
+
+def sequence_matcher_matrix(sentences):
+    similarity_matrix = np.eye(len(sentences))
+    for i in range(len(sentences)):
+        for j in range(i+1, len(sentences)):
+            similarity = SequenceMatcher(None, sentences[i], sentences[j]).ratio()
+            similarity_matrix[i, j] = similarity_matrix[j, i] = similarity
+    return similarity_matrix
+
+
+def sentence_similarity_matrix(sentences, metric=SIMILARITY_METRIC, tfidf_gram=None):
+    """Symmetric sentence-by-sentence similarity matrix in [0, 1] with ones on the diagonal.
+
+    The vector metrics take one matrix product for all pairs. tfidf_gram is
+    the Gram matrix of the L2-normalised TF-IDF rows, when the caller has
+    already computed it.
+    """
+    if metric not in SIMILARITY_METRICS:
+        raise ValueError(f"Unknown similarity metric: {metric}")
+    if metric == "sequence_matcher":
+        return sequence_matcher_matrix(sentences)
+    if not sentences:
+        return np.eye(0)
+
+    if metric == "tfidf":
+        if tfidf_gram is None:
+            raise ValueError("The tfidf metric needs the TF-IDF Gram matrix")
+        similarity_matrix = np.array(tfidf_gram, dtype=float)
+    else:
+        ngrams = char_ngram_matrix(sentences)
+        shared = gram_matrix(ngrams)
+        sizes = np.diff(ngrams.indptr).astype(float)
+        if metric == "char_dice":
+            denominator = sizes[:, None] + sizes[None, :]
+            numerator = 2 * shared
+        else:
+            denominator = np.sqrt(sizes[:, None] * sizes[None, :])
+            numerator = shared
+        similarity_matrix = np.divide(numerator, denominator, out=np.zeros_like(shared, dtype=float), where=denominator > 0)
+
+    np.clip(similarity_matrix, 0.0, 1.0, out=similarity_matrix)
+    np.fill_diagonal(similarity_matrix, 1.0)
+    return similarity_matrix
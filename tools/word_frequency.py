@@ -0,0 +1,119 @@
+import os
+import threading
+import unicodedata
+from importlib.metadata import version
+from functools import lru_cache
+import numpy as np
+import wordfreq
+from wordfreq import word_frequency
+
+# Precomputed table of wordfreq's frequencies: the sorted vocabulary as
+# fixed-width UTF-8 bytes next to word_frequency() of every entry. It is built
+# once from wordfreq's list, saved as a .npy file and memory-mapped, so every
+# process shares the pages and a lookup is one np.searchsorted over all tokens.
+FREQUENCY_LANG = "en"
+MAX_WORD_BYTES = 32
+FREQUENCY_TABLE_PATH = os.environ.get(
+    "WORD_FREQUENCY_TABLE",
+    os.path.join(
+        os.path.expanduser("~"), ".cache", "ielts_grader",
+        f"wordfreq-{version('wordfreq')}-{FREQUENCY_LANG}.npy"
+    )
+)
+
+# Zipf scale: log10 of the frequency per billion words. wordfreq lists words
+# from about 1 (rare) to 7 ("the"); 0 means the word is not in the list,
+# e.g. a misspelling. Each band holds the Zipf values from its lower edge up to
+# the next band's.
+ZIPF_BANDS = [
+    ("rare", 0.0),
+    ("uncommon", 3.0),
+    ("common", 4.0),
+    ("very_common", 5.0),
+]
+RARE_ZIPF = 3.0
+
+_table = None
+_lock = threading.Lock()
+
+
+def table_key(word):
+    """The form wordfreq looks a word up under: NFC-normalised and case-folded."""
+    return unicodedata.normalize("NFC", word).casefold()
+
+
+def build_frequency_table(path=FREQUENCY_TABLE_PATH, lang=FREQUENCY_LANG):
+    """Write the frequency table of wordfreq's list for lang to path and return it.
+
+    Each value is word_frequency() of the entry itself, with its rounding, so a
+    table hit equals what word_frequency would have returned.
+    """
+    words = sorted(
+        key.encode("utf-8") for key in wordfreq.get_frequency_dict(lang)
+        if len(key.encode("utf-8")) <= MAX_WORD_BYTES
+    )
+    table = np.empty(len(words), dtype=[("word", f"S{MAX_WORD_BYTES}"), ("frequency", "<f8")])
+    table["word"] = words
+    table["frequency"] = [word_frequency(word.decode("utf-8"), lang) for word in words]
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    # Written under a temporary name, so a concurrent reader never maps half a file
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, "wb") as file:
+        np.save(file, table)
+    os.replace(temp_path, path)
+    return table
+
+
+def get_frequency_table():
+    """The process-wide memory-mapped table, built on first use when the file is missing."""
+    global _table
+    if _table is None:
+        with _lock:
+            if _table is None:
+                if not os.path.exists(FREQUENCY_TABLE_PATH):
+                    print(f"Building the word frequency table at {FREQUENCY_TABLE_PATH}")
+                    build_frequency_table(FREQUENCY_TABLE_PATH)
+                _table = np.load(FREQUENCY_TABLE_PATH, mmap_mode="r")
+    return _table
+
+
+@lru_cache(maxsize=65536)
+def fallback_frequency(word):
+    """word_frequency of a token missing from the table: punctuation, numbers, multi-part tokens."""
+    return word_frequency(word, FREQUENCY_LANG)
+
+
+def word_frequencies(words):
+    """wordfreq frequencies of a sequence of tokens, as a float array.
+
+    Each distinct token is looked up once: the whole vocabulary is binary
+    searched in the table in one call and only the misses go through wordfreq.
+    """
+    if len(words) == 0:
+        return np.zeros(0)
+    vocabulary, inverse = np.unique(np.asarray(words, dtype=str), return_inverse=True)
+    keys = [table_key(word).encode("utf-8") for word in vocabulary]
+    fits = np.array([len(key) <= MAX_WORD_BYTES for key in keys])
+    queries = np.array(keys, dtype=f"S{MAX_WORD_BYTES}")
+
+    table = get_frequency_table()
+    positions = np.minimum(np.searchsorted(table["word"], queries), len(table) - 1)
+    hits = fits & (table["word"][positions] == queries)
+
+    frequencies = np.where(hits, table["frequency"][positions], 0.0)
+    for index in np.flatnonzero(~hits):
+        frequencies[index] = fallback_frequency(str(vocabulary[index]))
+    return frequencies[inverse.reshape(-1)]
+
+
+def zipf_values(frequencies):
+    """Zipf values of frequencies, 0 for words wordfreq does not know."""
+    frequencies = np.asarray(frequencies, dtype=float)
+    with np.errstate(divide="ignore"):
+        return np.where(frequencies > 0, np.log10(frequencies) + 9, 0.0)
+
+
+def zipf_bands(zipf):
+    """Index into ZIPF_BANDS of every known word's Zipf value."""
+    return np.searchsorted([edge for _, edge in ZIPF_BANDS[1:]], zipf, side="right")
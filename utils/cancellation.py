@@ -0,0 +1,54 @@
+import asyncio
+import threading
+
+
+class RunCancelled(Exception):
+    """Raised inside a workflow run whose cancellation token was cancelled."""
+
+
+class CancellationToken:
+    """Cooperative cancellation of one workflow run.
+
+    Agent nodes check the token before calling their model, so the remaining
+    nodes are skipped, and coroutines started with run() are cancelled, which
+    aborts their in-flight HTTP requests.
+    """
+
+    def __init__(self):
+        self.cancelled = False
+        self._tasks = set()
+        self._lock = threading.Lock()
+
+    def cancel(self):
+        with self._lock:
+            self.cancelled = True
+            tasks = list(self._tasks)
+        # May be called from another thread or loop than the one running the tasks
+        for loop, task in tasks:
+            loop.call_soon_threadsafe(task.cancel)
+
+    def check(self):
+        if self.cancelled:
+            raise RunCancelled()
+
+    async def run(self, coroutine):
+        """Await the coroutine as a task that cancel() can abort."""
+        self.check()
+        task = asyncio.ensure_future(coroutine)
+        entry = (asyncio.get_running_loop(), task)
+        with self._lock:
+            self._tasks.add(entry)
+        try:
+            return await task
+        except asyncio.CancelledError:
+            if self.cancelled:
+                raise RunCancelled()
+            raise
+        finally:
+            with self._lock:
+                self._tasks.discard(entry)
+
+
+def get_cancel_token(config):
+    """The run's token from a LangGraph config, passed as configurable["cancel_token"]."""
+    return (config or {}).get("configurable", {}).get("cancel_token")
@@ -4,6 +4,9 @@ import yaml
 from textwrap import wrap
 
 
+# modification time of every config file already loaded into the environment
+_loaded_configs = {}
+
 # for loading configs to environment variables
 def load_config(file_path):
     # Define default values
@@ -13,6 +16,11 @@ def load_config(file_path):
         'SERPER_API_KEY': 'default_groq_api_key',
     }
     
+    # Only re-parse the YAML when the file has changed since the last load
+    modified = os.path.getmtime(file_path)
+    if _loaded_configs.get(os.path.abspath(file_path)) == modified:
+        return
+
     with open(file_path, 'r') as file:
         config = yaml.safe_load(file)
         for key, value in config.items():
@@ -21,6 +29,8 @@ def load_config(file_path):
                 os.environ[key] = default_values.get(key, '')
             else:
                 os.environ[key] = value
+
+    _loaded_configs[os.path.abspath(file_path)] = modified
 # def load_config(file_path):
 #     with open(file_path, 'r') as file:
 #         config = yaml.safe_load(file)